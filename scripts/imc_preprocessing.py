@@ -14,7 +14,7 @@ from typing import List
 import pandas as pd
 
 import imcsegpipe
-from imcsegpipe.utils import sort_channels_by_mass
+from imcsegpipe.utils import AnalysisStack, sort_channels_by_mass
 
 # %% [markdown]
 #
@@ -182,12 +182,13 @@ for acquisition_dir in acquisitions_dir.glob("[!.]*"):
 #
 # **Of note:** Both image stacks are now by default hot pixel filtered (see below). To write out the raw image data without filtering set `hpf=None`.
 #
-# The `create_analysis_stacks` function takes several arguments:
+# The `create_multiple_analysis_stacks` function reads each `.ome.tiff` file only once and writes all requested stacks. It takes several arguments:
 #
 # * `acquisition_dir`: specifies the folder containing the `.ome.tiff` files.  
-# * `analysis_dir`: specifies the folder where the `.tiff` stacks should be stored.  
-# * `analysis_channels`: specifies the channel names used for the specific image stack.  
-# * `suffix`: the suffix to be added at the end of the file name.
+# * `analysis_stacks`: specifies the image stacks to generate. For each `AnalysisStack`, the following is specified:
+#     * `analysis_dir`: specifies the folder where the `.tiff` stacks should be stored.  
+#     * `analysis_channels`: specifies the channel names used for the specific image stack.  
+#     * `suffix`: the suffix to be added at the end of the file name.
 # * `hpf`: single number indicating the threshold for hot pixel filtering (see below). Setting `hpf=None` disables hot pixel filtering. 
 #
 # **Hot pixel filtering:** Each pixel intensity is compared against the maximum intensity of the 3x3 neighboring pixels. If the difference is larger than `hpf`, the pixel intensity is clipped to the maximum intensity in the 3x3 neighborhood. 
@@ -197,24 +198,26 @@ panel: pd.DataFrame = pd.read_csv(panel_file)
 
 for acquisition_dir in acquisitions_dir.glob("[!.]*"):
     if acquisition_dir.is_dir():
-        # Write full stack
-        imcsegpipe.create_analysis_stacks(
+        imcsegpipe.create_multiple_analysis_stacks(
             acquisition_dir=acquisition_dir,
-            analysis_dir=final_images_dir,
-            analysis_channels=sort_channels_by_mass(
-                panel.loc[panel[panel_keep_col] == 1, panel_channel_col].tolist()
-            ),
-            suffix="_full",
-            hpf=50.0,
-        )
-        # Write ilastik stack
-        imcsegpipe.create_analysis_stacks(
-            acquisition_dir=acquisition_dir,
-            analysis_dir=ilastik_dir,
-            analysis_channels=sort_channels_by_mass(
-                panel.loc[panel[panel_ilastik_col] == 1, panel_channel_col].tolist()
-            ),
-            suffix="_ilastik",
+            analysis_stacks=[
+                # Full stack
+                AnalysisStack(
+                    analysis_dir=final_images_dir,
+                    analysis_channels=sort_channels_by_mass(
+                        panel.loc[panel[panel_keep_col] == 1, panel_channel_col].tolist()
+                    ),
+                    suffix="_full",
+                ),
+                # Ilastik stack
+                AnalysisStack(
+                    analysis_dir=ilastik_dir,
+                    analysis_channels=sort_channels_by_mass(
+                        panel.loc[panel[panel_ilastik_col] == 1, panel_channel_col].tolist()
+                    ),
+                    suffix="_ilastik",
+                ),
+            ],
             hpf=50.0,
         )
 
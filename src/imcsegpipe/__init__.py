@@ -1,15 +1,63 @@
+from ._ilastik import prepare_ilastik_images
 from ._imcsegpipe import (
     create_analysis_stacks,
+    create_multiple_analysis_stacks,
     export_to_histocat,
     extract_mcd_file,
+    extract_mcd_file_to_hdf5,
     extract_zip_file,
+    extract_zip_mcd_files,
+    find_missing_channels,
     match_txt_files,
+    read_hdf5_acquisition,
+    read_hdf5_acquisition_metadata,
+    scan_mcd_file,
+    scan_zip_mcd_files,
 )
+from ._instrumentation import (
+    JsonlSink,
+    instrument,
+    read_instrumentation_events,
+    summarize_instrumentation_events,
+)
+from ._inventory import Inventory
+from ._measure import (
+    measure_cells,
+    measure_object_neighbors,
+    measure_objects,
+    write_object_neighbors,
+)
+from ._segment import segment_cells, segment_probabilities
+from ._sessions import process_sessions, scan_sessions
+from ._txt import read_txt_acquisition
 
 __all__ = [
+    "Inventory",
+    "JsonlSink",
     "create_analysis_stacks",
+    "create_multiple_analysis_stacks",
     "export_to_histocat",
     "extract_mcd_file",
+    "extract_mcd_file_to_hdf5",
     "extract_zip_file",
+    "extract_zip_mcd_files",
+    "find_missing_channels",
+    "instrument",
     "match_txt_files",
+    "measure_cells",
+    "measure_object_neighbors",
+    "measure_objects",
+    "prepare_ilastik_images",
+    "process_sessions",
+    "read_hdf5_acquisition",
+    "read_hdf5_acquisition_metadata",
+    "read_instrumentation_events",
+    "read_txt_acquisition",
+    "scan_mcd_file",
+    "scan_sessions",
+    "scan_zip_mcd_files",
+    "segment_cells",
+    "segment_probabilities",
+    "summarize_instrumentation_events",
+    "write_object_neighbors",
 ]
@@ -0,0 +1,163 @@
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from os import PathLike
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+import tifffile
+
+from ._manifest import atomic_file
+from .utils import IlastikPreparation
+
+ILASTIK_H5_DATASET = "stacked_channels"
+
+
+def prepare_ilastik_images(
+    ilastik_dir: Union[str, PathLike],
+    crops_dir: Union[str, PathLike],
+    ilastik_suffix: str = "_ilastik",
+    scale: int = 2,
+    crop_size: Optional[int] = 500,
+    seed: int = 0,
+    file_format: str = "h5",
+    workers: Optional[int] = None,
+) -> None:
+    preparation = IlastikPreparation(
+        crops_dir, scale=scale, crop_size=crop_size, seed=seed, file_format=file_format
+    )
+    Path(crops_dir).mkdir(exist_ok=True)
+    ilastik_img_files = sorted(Path(ilastik_dir).glob(f"[!.]*{ilastik_suffix}.tiff"))
+    if workers is not None and workers > 1 and len(ilastik_img_files) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(
+                executor.map(
+                    _prepare_ilastik_image_job,
+                    ilastik_img_files,
+                    [preparation] * len(ilastik_img_files),
+                )
+            )
+    else:
+        for ilastik_img_file in ilastik_img_files:
+            _prepare_ilastik_image_job(ilastik_img_file, preparation)
+
+
+def _get_ilastik_crop(
+    img_shape: Tuple[int, int], img_stem: str, crop_size: int, seed: int = 0
+) -> Tuple[int, int, int, int]:
+    height, width = img_shape
+    crop_width = min(crop_size, width)
+    crop_height = min(crop_size, height)
+    # the crop position only depends on the image name and the seed, such that
+    # the same crops are generated in every run
+    rng = np.random.default_rng([seed, zlib.crc32(img_stem.encode())])
+    crop_x = int(rng.integers(0, width - crop_width, endpoint=True))
+    crop_y = int(rng.integers(0, height - crop_height, endpoint=True))
+    return crop_x, crop_y, crop_width, crop_height
+
+
+def _prepare_ilastik_image_job(
+    ilastik_img_file: Path, preparation: IlastikPreparation
+) -> List[Path]:
+    ilastik_img = tifffile.imread(ilastik_img_file)
+    if ilastik_img.ndim == 2:
+        ilastik_img = ilastik_img[np.newaxis, :, :]
+    return _write_ilastik_images(
+        ilastik_img, ilastik_img_file.name[:-5], ilastik_img_file.parent, preparation
+    )
+
+
+def _write_ilastik_images(
+    ilastik_img: np.ndarray,
+    ilastik_img_stem: str,
+    ilastik_dir: Path,
+    preparation: IlastikPreparation,
+) -> List[Path]:
+    assert ilastik_img.ndim == 3
+    upscaled_img = _create_upscaled_ilastik_img(ilastik_img, preparation.scale)
+    upscaled_img_file = ilastik_dir / (
+        f"{ilastik_img_stem}_s{preparation.scale}.{preparation.file_format}"
+    )
+    _write_ilastik_image(upscaled_img, upscaled_img_file)
+    written_files = [upscaled_img_file]
+    if preparation.crop_size is not None:
+        crop_x, crop_y, crop_width, crop_height = _get_ilastik_crop(
+            upscaled_img.shape[1:],
+            ilastik_img_stem,
+            preparation.crop_size,
+            seed=preparation.seed,
+        )
+        crop_img_file = Path(preparation.crops_dir) / (
+            f"{ilastik_img_stem}_x{crop_x}_y{crop_y}_w{crop_width}_h{crop_height}"
+            f".{preparation.file_format}"
+        )
+        crop_img = upscaled_img[
+            :, crop_y : crop_y + crop_height, crop_x : crop_x + crop_width
+        ]
+        _write_ilastik_image(crop_img, crop_img_file)
+        written_files.append(crop_img_file)
+    return written_files
+
+
+def _create_upscaled_ilastik_img(ilastik_img: np.ndarray, scale: int) -> np.ndarray:
+    num_channels, height, width = ilastik_img.shape
+    upscaled_img = np.empty(
+        (num_channels + 1, height * scale, width * scale), dtype=np.uint16
+    )
+    # the first channel holds the channel average multiplied by 100, clipped to
+    # the uint16 range, as a visual help for labelling background pixels; as in
+    # the CellProfiler pipeline, images are clipped before they are upscaled
+    mean_img = np.mean(ilastik_img, axis=0, dtype=np.float32)
+    mean_img *= 100
+    upscaled_img[0] = _to_uint16(_upscale_img(_clip_to_uint16_range(mean_img), scale))
+    for channel_index in range(num_channels):
+        channel_img = ilastik_img[channel_index].astype(np.float32)
+        upscaled_img[channel_index + 1] = _to_uint16(
+            _upscale_img(_clip_to_uint16_range(channel_img), scale)
+        )
+    return upscaled_img
+
+
+def _upscale_img(img: np.ndarray, scale: int) -> np.ndarray:
+    # bilinear interpolation with pixel centers aligned as in CellProfiler's
+    # Resize module (skimage.transform.resize), one separable pass per axis
+    return _upscale_rows(_upscale_rows(img, scale).T, scale).T
+
+
+def _upscale_rows(img: np.ndarray, scale: int) -> np.ndarray:
+    height, width = img.shape
+    padded_img = np.pad(img, ((0, 0), (1, 1)), mode="edge")
+    upscaled_img = np.empty((height, width * scale), dtype=np.float32)
+    for phase in range(scale):
+        # output pixels of the same phase interpolate between the same input
+        # pixel and either its left or its right neighbor
+        offset = (phase + 0.5) / scale - 0.5
+        neighbor_img = padded_img[:, :-2] if offset < 0 else padded_img[:, 2:]
+        phase_img = img * np.float32(1 - abs(offset))
+        phase_img += neighbor_img * np.float32(abs(offset))
+        upscaled_img[:, phase::scale] = phase_img
+    return upscaled_img
+
+
+def _clip_to_uint16_range(img: np.ndarray) -> np.ndarray:
+    np.clip(img, 0, np.iinfo(np.uint16).max, out=img)
+    return img
+
+
+def _to_uint16(img: np.ndarray) -> np.ndarray:
+    np.rint(img, out=img)
+    return _clip_to_uint16_range(img).astype(np.uint16)
+
+
+def _write_ilastik_image(img: np.ndarray, img_file: Path) -> None:
+    with atomic_file(img_file) as temp_img_file:
+        if img_file.suffix == ".h5":
+            import h5py
+
+            # channels last, as written by CellProfiler's SaveImages module
+            with h5py.File(temp_img_file, "w") as f:
+                f.create_dataset(
+                    ILASTIK_H5_DATASET, data=np.moveaxis(img, 0, -1), chunks=True
+                )
+        else:
+            tifffile.imwrite(temp_img_file, data=img, imagej=True)
@@ -1,9 +1,33 @@
 import logging
+import os
 import re
 import shutil
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import lru_cache
+from importlib.util import find_spec
+from io import BytesIO, StringIO
 from os import PathLike
-from pathlib import Path
-from typing import Dict, List, Optional, Sequence, Union
+from pathlib import Path, PurePosixPath
+from tempfile import TemporaryDirectory
+from typing import (
+    TYPE_CHECKING,
+    BinaryIO,
+    Callable,
+    Container,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+from weakref import WeakKeyDictionary
+from xml.etree import ElementTree as ET
 from zipfile import ZipFile
 
 import imageio
@@ -14,31 +38,194 @@ import xtiff
 from readimc import MCDFile, TXTFile
 from readimc.data import Acquisition, Panorama, Slide
 
-from .utils import AcquisitionMetadata, filter_hot_pixels, get_acquisition_ome_xml
+from ._ilastik import _write_ilastik_images
+from ._instrumentation import (
+    _set_bytes_written,
+    _set_sinks,
+    _stage,
+    _worker_sinks,
+)
+from ._manifest import atomic_file
+from ._txt import _get_txt_file_sha256, read_txt_acquisition
+from .utils import (
+    AcquisitionMetadata,
+    AnalysisStack,
+    _get_xml_annotation_elem,
+    filter_hot_pixels,
+    get_acquisition_ome_xml,
+)
+
+if TYPE_CHECKING:
+    import h5py
+
+    from ._inventory import Inventory
+
+OVERVIEW_IMAGE_FORMATS = [None, "png", "thumbnail", "pyramid"]
+
+MCD_SCHEMA_TAIL_SIZE = 16 * 1024 * 1024
+
+MCD_CHANNEL_GROUP_SIZE = 256 * 1024 * 1024
+
+MCD_ROW_CHUNK_SIZE = 64 * 1024 * 1024
+
+# compression schemes that tifffile can write without the imagecodecs package
+TIFF_BUILTIN_COMPRESSIONS = ["zlib", "deflate", "adobe_deflate", "lzma"]
+
+# file names starting with an acquisition image stem, e.g. masks
+_ACQUISITION_IMG_STEM_REGEX = re.compile(
+    r"^(?P<acquisition>(?P<session>.+?)_s\d+_a(?P<acquisition_id>\d+)_ac)"
+)
 
 
 def extract_zip_file(
-    zip_file: Union[str, PathLike], dest_dir: Union[str, PathLike]
+    zip_file: Union[str, PathLike],
+    dest_dir: Union[str, PathLike],
+    members: Optional[Sequence[str]] = None,
 ) -> None:
     with ZipFile(zip_file, allowZip64=True) as f:
-        f.extractall(dest_dir)
+        f.extractall(dest_dir, members=members)
+
+
+def extract_zip_mcd_files(
+    zip_file: Union[str, PathLike],
+    acquisitions_dir: Union[str, PathLike],
+    temp_dir: Optional[Union[str, PathLike]] = None,
+    workers: Optional[int] = None,
+    analysis_stacks: Optional[Sequence[AnalysisStack]] = None,
+    hpf: Optional[float] = None,
+    histocat_dir: Optional[Union[str, PathLike]] = None,
+    tile_size: Optional[int] = None,
+    compression: Optional[str] = None,
+    predictor: bool = False,
+    dtype: Optional[str] = None,
+    embed_schema: bool = True,
+    overview_images: Optional[str] = "png",
+    thumbnail_size: int = 1024,
+    defer_overview_images: bool = False,
+    txt_cache_dir: Optional[Union[str, PathLike]] = None,
+    txt_workers: Optional[int] = None,
+    pipeline_depth: Optional[int] = None,
+) -> pd.DataFrame:
+    Path(acquisitions_dir).mkdir(exist_ok=True)
+    with ZipFile(zip_file, allowZip64=True) as f:
+        matched_txt_member_names_by_mcd = _match_zip_member_names(f.namelist())
+        member_compressed_sizes = {
+            zip_info.filename: zip_info.compress_size for zip_info in f.infolist()
+        }
+    acquisition_metadatas = []
+    for (
+        mcd_member_name,
+        matched_txt_member_names,
+    ) in matched_txt_member_names_by_mcd.items():
+        # only the .mcd file and its .txt files are extracted, and removed again
+        # as soon as all acquisitions have been written
+        with TemporaryDirectory(dir=temp_dir) as mcd_temp_dir:
+            with _stage(
+                "zip_extraction", file=Path(zip_file).name, member=mcd_member_name
+            ) as event:
+                extract_zip_file(
+                    zip_file,
+                    mcd_temp_dir,
+                    members=[mcd_member_name] + matched_txt_member_names,
+                )
+                event["bytes_read"] = sum(
+                    member_compressed_sizes[member_name]
+                    for member_name in [mcd_member_name] + matched_txt_member_names
+                )
+                _set_bytes_written(event, mcd_temp_dir)
+            acquisition_metadata = extract_mcd_file(
+                Path(mcd_temp_dir) / mcd_member_name,
+                Path(acquisitions_dir) / PurePosixPath(mcd_member_name).stem,
+                txt_files=[
+                    Path(mcd_temp_dir) / txt_member_name
+                    for txt_member_name in matched_txt_member_names
+                ],
+                workers=workers,
+                analysis_stacks=analysis_stacks,
+                hpf=hpf,
+                histocat_dir=histocat_dir,
+                tile_size=tile_size,
+                compression=compression,
+                predictor=predictor,
+                dtype=dtype,
+                embed_schema=embed_schema,
+                overview_images=overview_images,
+                thumbnail_size=thumbnail_size,
+                defer_overview_images=defer_overview_images,
+                txt_cache_dir=txt_cache_dir,
+                txt_workers=txt_workers,
+                pipeline_depth=pipeline_depth,
+            )
+        acquisition_metadatas.append(acquisition_metadata)
+    if len(acquisition_metadatas) == 0:
+        return pd.DataFrame()
+    return pd.concat(acquisition_metadatas, copy=False)
+
+
+def scan_mcd_file(
+    mcd_file: Union[str, PathLike],
+    txt_files: Optional[Sequence[Union[str, PathLike]]] = None,
+    dtype: Optional[str] = None,
+) -> pd.DataFrame:
+    if dtype is not None and not np.issubdtype(np.dtype(dtype), np.integer):
+        raise ValueError(f"Data type is not an integer data type: {dtype}")
+    with _stage("metadata_scan", file=Path(mcd_file).name) as event:
+        with MCDFile(mcd_file) as f_mcd:
+            acquisition_metadata = _scan_mcd_file(f_mcd, txt_files or [], dtype)
+            event["bytes_read"] = len(f_mcd.schema_xml.encode("utf-16-le"))
+    return acquisition_metadata
+
+
+def scan_zip_mcd_files(
+    zip_file: Union[str, PathLike],
+    temp_dir: Optional[Union[str, PathLike]] = None,
+    dtype: Optional[str] = None,
+) -> pd.DataFrame:
+    if dtype is not None and not np.issubdtype(np.dtype(dtype), np.integer):
+        raise ValueError(f"Data type is not an integer data type: {dtype}")
+    acquisition_metadatas = []
+    with ZipFile(zip_file, allowZip64=True) as f:
+        matched_txt_member_names_by_mcd = _match_zip_member_names(f.namelist())
+        for (
+            mcd_member_name,
+            matched_txt_member_names,
+        ) in matched_txt_member_names_by_mcd.items():
+            with TemporaryDirectory(dir=temp_dir) as mcd_temp_dir:
+                mcd_file = Path(mcd_temp_dir) / mcd_member_name
+                mcd_file.parent.mkdir(parents=True, exist_ok=True)
+                with _stage(
+                    "metadata_scan", file=Path(zip_file).name, member=mcd_member_name
+                ) as event:
+                    f_mcd = _open_zip_mcd_file(f, mcd_member_name, mcd_file)
+                    try:
+                        acquisition_metadata = _scan_mcd_file(
+                            f_mcd, matched_txt_member_names, dtype
+                        )
+                    finally:
+                        f_mcd.close()
+                    _set_bytes_written(event, mcd_temp_dir)
+            acquisition_metadatas.append(acquisition_metadata)
+    if len(acquisition_metadatas) == 0:
+        return pd.DataFrame()
+    return pd.concat(acquisition_metadatas, copy=False)
 
 
 def match_txt_files(
     mcd_files: Sequence[Union[str, PathLike]], txt_files: Sequence[Union[str, PathLike]]
 ) -> Dict[Union[str, PathLike], List[Path]]:
-    unmatched_txt_files = list(txt_files)
     matched_txt_files: Dict[Union[str, PathLike], List[Path]] = {}
+    mcd_files_by_stem: Dict[str, Union[str, PathLike]] = {}
     for mcd_file in sorted(mcd_files, key=lambda x: Path(x).stem, reverse=True):
         matched_txt_files[mcd_file] = []
-        i = 0
-        while i < len(unmatched_txt_files):
-            txt_file = unmatched_txt_files[i]
-            if Path(txt_file).stem.startswith(Path(mcd_file).stem):
-                matched_txt_files[mcd_file].append(Path(txt_file))
-                unmatched_txt_files.remove(txt_file)
-                i -= 1
-            i += 1
+        mcd_files_by_stem.setdefault(Path(mcd_file).stem, mcd_file)
+    unmatched_txt_files = []
+    for txt_file in txt_files:
+        mcd_file_stem = _match_txt_file_stem(Path(txt_file).stem, mcd_files_by_stem)
+        if mcd_file_stem is not None:
+            mcd_file = mcd_files_by_stem[mcd_file_stem]
+            matched_txt_files[mcd_file].append(Path(txt_file))
+        else:
+            unmatched_txt_files.append(txt_file)
     if len(unmatched_txt_files) > 0:
         unmatched_txt_file_names = [Path(f).name for f in unmatched_txt_files]
         logging.warning(
@@ -48,159 +235,639 @@ def match_txt_files(
     return matched_txt_files
 
 
+def _match_zip_member_names(member_names: Sequence[str]) -> Dict[str, List[str]]:
+    member_names = [
+        member_name
+        for member_name in member_names
+        if not member_name.endswith("/")
+        and not PurePosixPath(member_name).stem.startswith(".")
+    ]
+    mcd_member_names = sorted(
+        member_name
+        for member_name in member_names
+        if PurePosixPath(member_name).suffix.lower() == ".mcd"
+    )
+    txt_member_names = [
+        member_name
+        for member_name in member_names
+        if PurePosixPath(member_name).suffix.lower() == ".txt"
+    ]
+    matched_txt_files = match_txt_files(mcd_member_names, txt_member_names)
+    txt_member_names_by_path = {
+        Path(member_name): member_name for member_name in txt_member_names
+    }
+    return {
+        mcd_member_name: [
+            txt_member_names_by_path[txt_file]
+            for txt_file in matched_txt_files[mcd_member_name]
+        ]
+        for mcd_member_name in mcd_member_names
+    }
+
+
+def _match_txt_file_stem(
+    txt_file_stem: str, mcd_file_stems: Container[str]
+) -> Optional[str]:
+    # .txt files are matched to the longest .mcd file stem they start with,
+    # looking up each prefix instead of comparing all pairs of files
+    for prefix_length in range(len(txt_file_stem), -1, -1):
+        if txt_file_stem[:prefix_length] in mcd_file_stems:
+            return txt_file_stem[:prefix_length]
+    return None
+
+
 def extract_mcd_file(
     mcd_file: Union[str, PathLike],
     acquisition_dir: Union[str, PathLike],
     txt_files: Optional[Sequence[Union[str, PathLike]]] = None,
+    workers: Optional[int] = None,
+    analysis_stacks: Optional[Sequence[AnalysisStack]] = None,
+    hpf: Optional[float] = None,
+    histocat_dir: Optional[Union[str, PathLike]] = None,
+    tile_size: Optional[int] = None,
+    compression: Optional[str] = None,
+    predictor: bool = False,
+    dtype: Optional[str] = None,
+    embed_schema: bool = True,
+    overview_images: Optional[str] = "png",
+    thumbnail_size: int = 1024,
+    defer_overview_images: bool = False,
+    txt_cache_dir: Optional[Union[str, PathLike]] = None,
+    txt_workers: Optional[int] = None,
+    pipeline_depth: Optional[int] = None,
 ) -> pd.DataFrame:
+    if tile_size is not None and (tile_size < 16 or tile_size % 16 != 0):
+        raise ValueError(f"Tile size is not a positive multiple of 16: {tile_size}")
+    if dtype is not None and not np.issubdtype(np.dtype(dtype), np.integer):
+        raise ValueError(f"Data type is not an integer data type: {dtype}")
+    if overview_images not in OVERVIEW_IMAGE_FORMATS:
+        raise ValueError(f"Unsupported overview image format: {overview_images}")
+    _check_compression(compression, predictor=predictor, dtype=dtype)
     acquisition_origins = {}
     acquisition_is_valids = {}
     Path(acquisition_dir).mkdir(exist_ok=True)
-    with MCDFile(mcd_file) as f_mcd:
-        schema_xml_file = Path(acquisition_dir) / f"{Path(mcd_file).stem}_schema.xml"
-        _extract_schema(f_mcd, schema_xml_file)
-        for slide in f_mcd.slides:
-            slide_stem = f"{Path(mcd_file).stem}_s{slide.id}"
-            slide_img_file = Path(acquisition_dir) / f"{slide_stem}_slide.png"
-            _extract_slide(f_mcd, slide, slide_img_file)
-            for panorama in slide.panoramas:
-                panorama_img_file = (
-                    Path(acquisition_dir) / f"{slide_stem}_p{panorama.id}_pano.png"
+    if analysis_stacks is not None:
+        for analysis_stack in analysis_stacks:
+            Path(analysis_stack.analysis_dir).mkdir(exist_ok=True)
+    if histocat_dir is not None:
+        Path(histocat_dir).mkdir(exist_ok=True)
+    # worker pools are shut down before the worker sinks are closed
+    with _worker_sinks() as worker_sinks, MCDFile(mcd_file) as f_mcd:
+        acquisition_img_files = {
+            acquisition.id: Path(acquisition_dir)
+            / f"{Path(mcd_file).stem}_s{slide.id}_a{acquisition.id}_ac.ome.tiff"
+            for slide in f_mcd.slides
+            for acquisition in slide.acquisitions
+        }
+        if analysis_stacks is not None:
+            # the panel is checked before extracting any acquisitions
+            _check_analysis_channels(
+                _get_mcd_file_channel_names(f_mcd), analysis_stacks
+            )
+        txt_file_index = _index_txt_files(txt_files or [])
+        acquisition_futures: Dict[int, Future[Tuple[str, bool]]] = {}
+        executor = None
+        if workers is not None and workers > 1 and len(acquisition_img_files) > 1:
+            # acquisitions are submitted first, such that the worker processes
+            # can start while slides and panoramas are extracted in this process
+            executor = ProcessPoolExecutor(
+                max_workers=min(workers, len(acquisition_img_files)),
+                initializer=_init_mcd_file_worker,
+                initargs=(mcd_file, worker_sinks),
+            )
+            for slide in f_mcd.slides:
+                for acquisition in slide.acquisitions:
+                    acquisition_futures[acquisition.id] = executor.submit(
+                        _extract_acquisition_job,
+                        slide.id,
+                        acquisition.id,
+                        acquisition_img_files[acquisition.id],
+                        acquisition_txt_files=txt_file_index.get(
+                            str(acquisition.id), []
+                        ),
+                        analysis_stacks=analysis_stacks,
+                        hpf=hpf,
+                        histocat_dir=histocat_dir,
+                        tile_size=tile_size,
+                        compression=compression,
+                        predictor=predictor,
+                        dtype=dtype,
+                        embed_schema=embed_schema,
+                        txt_cache_dir=txt_cache_dir,
+                    )
+        txt_futures: Dict[int, Future[str]] = {}
+        txt_executor = None
+        txt_temp_dir = None
+        if executor is None and txt_workers is not None and txt_workers > 1:
+            # .txt files of acquisitions with corrupted data are decoded in
+            # parallel into the .txt cache (or a temporary directory), while the
+            # other acquisitions are extracted in this process
+            corrupted_txt_files = {
+                acquisition.id: txt_file_index[str(acquisition.id)][0]
+                for slide in f_mcd.slides
+                for acquisition in slide.acquisitions
+                if len(txt_file_index.get(str(acquisition.id), [])) == 1
+                and not _is_acquisition_data_valid(f_mcd, acquisition)
+            }
+            if len(corrupted_txt_files) > 0:
+                if txt_cache_dir is None:
+                    txt_temp_dir = TemporaryDirectory(dir=acquisition_dir, prefix=".")
+                    txt_cache_dir = txt_temp_dir.name
+                txt_executor = ProcessPoolExecutor(
+                    max_workers=min(txt_workers, len(corrupted_txt_files)),
+                    initializer=_set_sinks,
+                    initargs=(worker_sinks,),
                 )
-                _extract_panorama(f_mcd, panorama, panorama_img_file)
-            for acquisition in slide.acquisitions:
-                acquisition_img_file = (
-                    Path(acquisition_dir)
-                    / f"{slide_stem}_a{acquisition.id}_ac.ome.tiff"
+                for acquisition_id, txt_file in corrupted_txt_files.items():
+                    txt_futures[acquisition_id] = txt_executor.submit(
+                        _decode_txt_file_job, txt_file, txt_cache_dir
+                    )
+        overview_executor = None
+        acquisition_results = None
+        try:
+            schema_xml_file = (
+                Path(acquisition_dir) / f"{Path(mcd_file).stem}_schema.xml"
+            )
+            _extract_schema(f_mcd, schema_xml_file)
+            if overview_images is not None and defer_overview_images:
+                # slide and panorama images are extracted from a separate file
+                # handle in a background thread, while acquisitions are written
+                overview_executor = ThreadPoolExecutor(max_workers=1)
+                overview_executor.submit(
+                    _extract_overview_images_job,
+                    mcd_file,
+                    Path(acquisition_dir),
+                    overview_images,
+                    thumbnail_size,
                 )
-                acquisition_channels_file = acquisition_img_file.with_name(
-                    acquisition_img_file.name[:-9] + ".csv"
+            elif overview_images is not None:
+                _extract_overview_images(
+                    f_mcd, Path(acquisition_dir), overview_images, thumbnail_size
                 )
-                acquisition_origin = "mcd"
-                acquisition_is_valid = _extract_acquisition(
-                    f_mcd, acquisition, acquisition_img_file, acquisition_channels_file
+            if (
+                executor is None
+                and tile_size is None
+                and pipeline_depth is not None
+                and pipeline_depth > 1
+            ):
+                # the pipeline is only started after the overview images have
+                # been extracted, as the file handle is not shared between reads
+                acquisition_results = _extract_acquisitions_pipelined(
+                    f_mcd,
+                    [
+                        acquisition
+                        for slide in f_mcd.slides
+                        for acquisition in slide.acquisitions
+                    ],
+                    acquisition_img_files,
+                    pipeline_depth,
+                    txt_file_index=txt_file_index,
+                    txt_futures=txt_futures,
+                    analysis_stacks=analysis_stacks,
+                    hpf=hpf,
+                    histocat_dir=histocat_dir,
+                    compression=compression,
+                    predictor=predictor,
+                    dtype=dtype,
+                    embed_schema=embed_schema,
+                    txt_cache_dir=txt_cache_dir,
                 )
-                if not acquisition_is_valid and txt_files is not None:
-                    acquisition_txt_files = [
-                        txt_file
-                        for txt_file in txt_files
-                        if Path(txt_file).stem.endswith(f"_{acquisition.id}")
-                    ]
-                    if len(acquisition_txt_files) == 1:
-                        txt_file = acquisition_txt_files[0]
-                        logging.info(
-                            f"Attempting to restore acquisition {acquisition.id} "
-                            f"from file {Path(txt_file).name}"
+            for slide in f_mcd.slides:
+                for acquisition in slide.acquisitions:
+                    if executor is not None:
+                        acquisition_origin, acquisition_is_valid = acquisition_futures[
+                            acquisition.id
+                        ].result()
+                    elif acquisition_results is not None:
+                        acquisition_origin, acquisition_is_valid = next(
+                            acquisition_results
                         )
-                        with TXTFile(txt_file) as f_txt:
-                            acquisition_origin = "txt"
-                            acquisition_is_valid = _extract_acquisition_from_txt_file(
-                                f_mcd,
-                                f_txt,
-                                acquisition,
-                                acquisition_img_file,
-                                acquisition_channels_file,
-                            )
-                    elif len(acquisition_txt_files) > 1:
-                        acquisition_txt_file_names = [
-                            Path(f).name for f in acquisition_txt_files
-                        ]
-                        logging.warning(
-                            f"Multiple .txt files found for acquisition "
-                            f"{acquisition.id} in {Path(mcd_file).name}: "
-                            f"{acquisition_txt_file_names}"
+                    else:
+                        txt_file_sha256 = _get_decoded_txt_file_sha256(
+                            txt_futures.get(acquisition.id)
                         )
-                acquisition_origins[acquisition.id] = acquisition_origin
-                acquisition_is_valids[acquisition.id] = acquisition_is_valid
+                        (
+                            acquisition_origin,
+                            acquisition_is_valid,
+                        ) = _extract_acquisition_with_txt_fallback(
+                            f_mcd,
+                            acquisition,
+                            acquisition_img_files[acquisition.id],
+                            acquisition_txt_files=txt_file_index.get(
+                                str(acquisition.id), []
+                            ),
+                            analysis_stacks=analysis_stacks,
+                            hpf=hpf,
+                            histocat_dir=histocat_dir,
+                            tile_size=tile_size,
+                            compression=compression,
+                            predictor=predictor,
+                            dtype=dtype,
+                            embed_schema=embed_schema,
+                            txt_cache_dir=txt_cache_dir,
+                            txt_file_sha256=txt_file_sha256,
+                        )
+                    acquisition_origins[acquisition.id] = acquisition_origin
+                    acquisition_is_valids[acquisition.id] = acquisition_is_valid
+        finally:
+            if acquisition_results is not None:
+                acquisition_results.close()
+            if executor is not None:
+                for acquisition_future in acquisition_futures.values():
+                    acquisition_future.cancel()
+                executor.shutdown()
+            if overview_executor is not None:
+                overview_executor.shutdown()
+            if txt_executor is not None:
+                for txt_future in txt_futures.values():
+                    txt_future.cancel()
+                txt_executor.shutdown()
+            if txt_temp_dir is not None:
+                txt_temp_dir.cleanup()
         return _create_acquisition_metadata(
             f_mcd, acquisition_origins, acquisition_is_valids
         )
 
 
+def extract_mcd_file_to_hdf5(
+    mcd_file: Union[str, PathLike],
+    hdf5_file: Union[str, PathLike],
+    txt_files: Optional[Sequence[Union[str, PathLike]]] = None,
+    chunk_size: Optional[int] = None,
+    compression: Optional[str] = "gzip",
+    dtype: Optional[str] = None,
+    txt_cache_dir: Optional[Union[str, PathLike]] = None,
+) -> pd.DataFrame:
+    import h5py
+
+    if dtype is not None and not np.issubdtype(np.dtype(dtype), np.integer):
+        raise ValueError(f"Data type is not an integer data type: {dtype}")
+
+    acquisition_origins = {}
+    acquisition_is_valids = {}
+    txt_file_index = _index_txt_files(txt_files or [])
+    with MCDFile(mcd_file) as f_mcd:
+        with atomic_file(hdf5_file) as temp_hdf5_file:
+            with h5py.File(temp_hdf5_file, "w") as f_hdf5:
+                try:
+                    f_hdf5["schema_xml"] = f_mcd.schema_xml
+                except Exception as e:
+                    logging.error(
+                        f"Error reading schema XML from file {f_mcd.path.name}: {e}"
+                    )
+                for slide in f_mcd.slides:
+                    slide_stem = f"{Path(mcd_file).stem}_s{slide.id}"
+                    try:
+                        slide_img = f_mcd.read_slide(slide)
+                        if slide_img is not None:
+                            f_hdf5.create_dataset(
+                                f"slides/{slide_stem}_slide",
+                                data=slide_img,
+                                compression=compression,
+                            )
+                    except Exception as e:
+                        logging.error(
+                            f"Error reading slide {slide.id} "
+                            f"from file {f_mcd.path.name}: {e}"
+                        )
+                    for panorama in slide.panoramas:
+                        try:
+                            f_hdf5.create_dataset(
+                                f"panoramas/{slide_stem}_p{panorama.id}_pano",
+                                data=f_mcd.read_panorama(panorama),
+                                compression=compression,
+                            )
+                        except Exception as e:
+                            logging.error(
+                                f"Error reading panorama {panorama.id} "
+                                f"from file {f_mcd.path.name}: {e}"
+                            )
+                    for acquisition in slide.acquisitions:
+                        (
+                            acquisition_origin,
+                            acquisition_img,
+                        ) = _read_acquisition_with_txt_fallback(
+                            f_mcd,
+                            acquisition,
+                            acquisition_txt_files=txt_file_index.get(
+                                str(acquisition.id), []
+                            ),
+                            txt_cache_dir=txt_cache_dir,
+                        )
+                        if acquisition_img is not None and dtype is not None:
+                            acquisition_img = _convert_to_integer_dtype(
+                                acquisition_img,
+                                dtype,
+                                f"acquisition {acquisition.id} "
+                                f"from file {f_mcd.path.name}",
+                            )
+                        if acquisition_img is not None:
+                            _write_hdf5_acquisition(
+                                f_hdf5,
+                                f"{slide_stem}_a{acquisition.id}_ac",
+                                acquisition,
+                                acquisition_img,
+                                chunk_size=chunk_size,
+                                compression=compression,
+                            )
+                        acquisition_origins[acquisition.id] = acquisition_origin
+                        acquisition_is_valids[acquisition.id] = (
+                            acquisition_img is not None
+                        )
+                acquisition_metadata = _create_acquisition_metadata(
+                    f_mcd, acquisition_origins, acquisition_is_valids
+                )
+                f_hdf5["acquisition_metadata"] = acquisition_metadata.to_csv()
+    return acquisition_metadata
+
+
+def read_hdf5_acquisition_metadata(hdf5_file: Union[str, PathLike]) -> pd.DataFrame:
+    import h5py
+
+    with h5py.File(hdf5_file, "r") as f_hdf5:
+        acquisition_metadata_csv = f_hdf5["acquisition_metadata"][()].decode()
+    return pd.read_csv(StringIO(acquisition_metadata_csv), index_col=0)
+
+
+def read_hdf5_acquisition(
+    hdf5_file: Union[str, PathLike],
+    acquisition_stem: str,
+    channel_indices: Optional[Sequence[int]] = None,
+) -> Tuple[np.ndarray, pd.DataFrame]:
+    import h5py
+
+    with h5py.File(hdf5_file, "r") as f_hdf5:
+        acquisition_img = _Hdf5ChannelStack(f_hdf5["acquisitions"][acquisition_stem])
+        acquisition_channels = acquisition_img.get_channels()
+        if channel_indices is None:
+            channel_indices = range(acquisition_img.shape[0])
+        return acquisition_img[channel_indices], acquisition_channels
+
+
 def create_analysis_stacks(
     acquisition_dir: Union[str, PathLike],
     analysis_dir: Union[str, PathLike],
     analysis_channels: Sequence[str],
     suffix: Optional[str] = None,
     hpf: Optional[float] = None,
+    compression: Optional[str] = None,
+    predictor: bool = False,
 ) -> None:
-    Path(analysis_dir).mkdir(exist_ok=True)
-    for acquisition_img_file in Path(acquisition_dir).glob("[!.]*.ome.tiff"):
-        acquisition_channels_file = acquisition_img_file.with_name(
-            acquisition_img_file.name[:-9] + ".csv"
+    _check_compression(compression)
+    create_multiple_analysis_stacks(
+        acquisition_dir,
+        [AnalysisStack(analysis_dir, analysis_channels, suffix=suffix)],
+        hpf=hpf,
+        compression=compression,
+        predictor=predictor,
+    )
+
+
+def create_multiple_analysis_stacks(
+    acquisition_dir: Union[str, PathLike],
+    analysis_stacks: Sequence[AnalysisStack],
+    hpf: Optional[float] = None,
+    compression: Optional[str] = None,
+    predictor: bool = False,
+) -> None:
+    _check_compression(compression)
+    # the channel tables of all acquisitions are checked before writing any
+    # stacks, such that all incompatible acquisitions are reported at once
+    acquisition_channel_names = {
+        acquisition_img_stem: acquisition_channels["channel_name"].tolist()
+        for acquisition_img_stem, acquisition_channels in _iter_acquisition_channels(
+            acquisition_dir
         )
-        acquisition_img = tifffile.imread(acquisition_img_file)
-        assert acquisition_img.ndim == 3
-        acquisition_channels: pd.DataFrame = pd.read_csv(acquisition_channels_file)
-        assert len(acquisition_channels.index) == acquisition_img.shape[0]
-        analysis_channel_indices = [
-            acquisition_channels["channel_name"].tolist().index(channel_name)
-            for channel_name in analysis_channels
-        ]
-        analysis_img = acquisition_img[analysis_channel_indices]
-        analysis_img_file = Path(analysis_dir) / (
-            acquisition_img_file.name[:-9] + ".tiff"
+    }
+    _check_analysis_channels(acquisition_channel_names, analysis_stacks)
+    for analysis_stack in analysis_stacks:
+        Path(analysis_stack.analysis_dir).mkdir(exist_ok=True)
+    for (
+        acquisition_img_stem,
+        acquisition_channels,
+        acquisition_img,
+    ) in _iter_acquisition_imgs(acquisition_dir):
+        _write_analysis_stacks(
+            acquisition_img,
+            acquisition_channels["channel_name"].tolist(),
+            acquisition_img_stem,
+            analysis_stacks,
+            hpf=hpf,
+            compression=compression,
+            predictor=predictor,
         )
-        if suffix is not None:
-            analysis_img_file = analysis_img_file.with_name(
-                analysis_img_file.name[:-5] + suffix + ".tiff"
-            )
-        analysis_channels_file = analysis_img_file.with_suffix(".csv")
-        if hpf is not None:
-            analysis_img = filter_hot_pixels(analysis_img, hpf)
-        tifffile.imwrite(
-            analysis_img_file, data=analysis_img.astype(np.uint16), imagej=True
+
+
+def find_missing_channels(
+    acquisition_dir: Union[str, PathLike], analysis_channels: Sequence[str]
+) -> Dict[str, List[str]]:
+    missing_channels = {}
+    for acquisition_img_stem, acquisition_channels in _iter_acquisition_channels(
+        acquisition_dir
+    ):
+        channel_indices = _get_channel_indices(
+            tuple(acquisition_channels["channel_name"])
         )
-        with analysis_channels_file.open("w") as f:
-            f.write("\n".join(analysis_channels))
+        missing_channel_names = [
+            channel_name
+            for channel_name in analysis_channels
+            if channel_name not in channel_indices
+        ]
+        if len(missing_channel_names) > 0:
+            missing_channels[acquisition_img_stem] = missing_channel_names
+    return missing_channels
 
 
 def export_to_histocat(
     acquisition_dir: Union[str, PathLike],
     histocat_dir: Union[str, PathLike],
     mask_dir: Optional[Union[str, PathLike]] = None,
+    compression: Optional[str] = None,
+    predictor: bool = False,
+    workers: Optional[int] = None,
+    threads: Optional[int] = None,
+    incremental: bool = False,
+    inventory: Optional["Inventory"] = None,
 ) -> None:
+    _check_compression(compression)
     Path(histocat_dir).mkdir(exist_ok=True)
-    for acquisition_img_file in Path(acquisition_dir).glob("[!.]*.ome.tiff"):
-        acquisition_channels_file = acquisition_img_file.with_name(
-            acquisition_img_file.name[:-9] + ".csv"
-        )
-        acquisition_img = tifffile.imread(acquisition_img_file)
-        assert acquisition_img.ndim == 3
-        acquisition_channels: pd.DataFrame = pd.read_csv(acquisition_channels_file)
-        assert len(acquisition_channels.index) == acquisition_img.shape[0]
-        histocat_img_dir = Path(histocat_dir) / acquisition_img_file.name[:-9]
+    acquisition_mask_files: Dict[str, List[Path]] = {}
+    if mask_dir is not None:
+        acquisition_mask_files = _index_mask_files(mask_dir, inventory=inventory)
+    acquisition_img_stems = []
+    for acquisition_img_stem, acquisition_channels in _iter_acquisition_channels(
+        acquisition_dir
+    ):
+        histocat_img_dir = Path(histocat_dir) / acquisition_img_stem
+        if incremental and _is_histocat_img_dir_complete(
+            histocat_img_dir,
+            acquisition_channels,
+            _get_acquisition_img_file(acquisition_dir, acquisition_img_stem),
+        ):
+            _copy_histocat_mask(
+                acquisition_img_stem,
+                Path(histocat_dir),
+                acquisition_mask_files.get(acquisition_img_stem, []),
+            )
+            continue
+        # directories are created up front, instead of by each job
         histocat_img_dir.mkdir(exist_ok=True)
-        for channel_index, row in acquisition_channels.iterrows():
-            acquisition_channel_img: np.ndarray = acquisition_img[channel_index]
-            channel_name = row["channel_name"]
-            channel_label = row["channel_label"]
-            if not pd.isnull(channel_label) and not channel_label:
-                channel_label = re.sub("[^a-zA-Z0-9()]", "-", channel_label)
-            tifffile.imwrite(
-                histocat_img_dir
-                / f"{channel_label or channel_name}_{channel_name}.tiff",
-                data=acquisition_channel_img,
-                imagej=True,
+        acquisition_img_stems.append(acquisition_img_stem)
+    if workers is not None and workers > 1 and len(acquisition_img_stems) > 1:
+        with _worker_sinks() as worker_sinks, ProcessPoolExecutor(
+            max_workers=min(workers, len(acquisition_img_stems)),
+            initializer=_set_sinks,
+            initargs=(worker_sinks,),
+        ) as executor:
+            histocat_futures = [
+                executor.submit(
+                    _export_to_histocat_job,
+                    acquisition_dir,
+                    [acquisition_img_stem],
+                    histocat_dir,
+                    acquisition_mask_files={
+                        acquisition_img_stem: acquisition_mask_files.get(
+                            acquisition_img_stem, []
+                        )
+                    },
+                    compression=compression,
+                    predictor=predictor,
+                    threads=threads,
+                )
+                for acquisition_img_stem in acquisition_img_stems
+            ]
+            for histocat_future in histocat_futures:
+                histocat_future.result()
+    elif len(acquisition_img_stems) > 0:
+        _export_to_histocat_job(
+            acquisition_dir,
+            acquisition_img_stems,
+            histocat_dir,
+            acquisition_mask_files=acquisition_mask_files,
+            compression=compression,
+            predictor=predictor,
+            threads=threads,
+        )
+
+
+def _export_to_histocat_job(
+    acquisition_dir: Union[str, PathLike],
+    acquisition_img_stems: Sequence[str],
+    histocat_dir: Union[str, PathLike],
+    acquisition_mask_files: Optional[Dict[str, List[Path]]] = None,
+    compression: Optional[str] = None,
+    predictor: bool = False,
+    threads: Optional[int] = None,
+) -> None:
+    for (
+        acquisition_img_stem,
+        acquisition_channels,
+        acquisition_img,
+    ) in _iter_acquisition_imgs(acquisition_dir, acquisition_img_stems):
+        _write_histocat_images(
+            acquisition_img,
+            acquisition_channels,
+            Path(histocat_dir) / acquisition_img_stem,
+            compression=compression,
+            predictor=predictor,
+            threads=threads,
+        )
+        if acquisition_mask_files is not None:
+            _copy_histocat_mask(
+                acquisition_img_stem,
+                Path(histocat_dir),
+                acquisition_mask_files.get(acquisition_img_stem, []),
             )
-        if mask_dir is not None:
-            mask_files = list(
-                Path(mask_dir).glob(f"[!.]{acquisition_img_file.name[:-9]}*_mask.tiff")
+
+
+def _index_mask_files(
+    mask_dir: Union[str, PathLike], inventory: Optional["Inventory"] = None
+) -> Dict[str, List[Path]]:
+    # masks are indexed by acquisition image stem from a single listing of the
+    # mask directory (or inventory query), instead of one glob per acquisition
+    if inventory is not None:
+        mask_files = inventory.get_files(mask_dir, role="mask", recursive=False)
+    else:
+        mask_files = sorted(
+            Path(mask_dir) / entry.name
+            for entry in os.scandir(mask_dir)
+            if entry.is_file()
+            and not entry.name.startswith(".")
+            and entry.name.endswith("_mask.tiff")
+        )
+    acquisition_mask_files: Dict[str, List[Path]] = {}
+    for mask_file in mask_files:
+        m = _ACQUISITION_IMG_STEM_REGEX.match(mask_file.name)
+        if m is not None:
+            acquisition_mask_files.setdefault(m.group("acquisition"), []).append(
+                mask_file
             )
-            if len(mask_files) > 0:
-                if len(mask_files) > 1:
-                    logging.warning(
-                        "Multiple mask files found for image "
-                        f"{acquisition_img_file.name}: {mask_files}; "
-                        "using the first one"
-                    )
-                shutil.copy2(mask_files[0], histocat_dir)
+    return acquisition_mask_files
+
+
+def _copy_histocat_mask(
+    acquisition_img_stem: str,
+    histocat_dir: Path,
+    mask_files: Sequence[Path],
+) -> None:
+    if len(mask_files) > 0:
+        if len(mask_files) > 1:
+            logging.warning(
+                "Multiple mask files found for image "
+                f"{acquisition_img_stem}: {mask_files}; "
+                "using the first one"
+            )
+        histocat_mask_file = histocat_dir / mask_files[0].name
+        if (
+            histocat_mask_file.exists()
+            and histocat_mask_file.stat().st_mtime >= mask_files[0].stat().st_mtime
+        ):
+            return
+        with atomic_file(histocat_mask_file) as temp_histocat_mask_file:
+            shutil.copy2(mask_files[0], temp_histocat_mask_file)
+
+
+def _is_histocat_img_dir_complete(
+    histocat_img_dir: Path,
+    acquisition_channels: pd.DataFrame,
+    acquisition_img_file: Path,
+) -> bool:
+    # a single directory listing, instead of one stat call per channel
+    if not histocat_img_dir.is_dir():
+        return False
+    with os.scandir(histocat_img_dir) as it:
+        histocat_img_mtimes = {
+            entry.name: entry.stat().st_mtime for entry in it if entry.is_file()
+        }
+    acquisition_img_mtime = acquisition_img_file.stat().st_mtime
+    return all(
+        histocat_img_mtimes.get(histocat_img_name, -1.0) >= acquisition_img_mtime
+        for histocat_img_name in _get_histocat_img_names(acquisition_channels)
+    )
+
+
+def _get_histocat_img_names(acquisition_channels: pd.DataFrame) -> List[str]:
+    histocat_img_names = []
+    for channel_name, channel_label in zip(
+        acquisition_channels["channel_name"], acquisition_channels["channel_label"]
+    ):
+        if pd.isnull(channel_label):
+            channel_label = None
+        elif not channel_label:
+            channel_label = re.sub("[^a-zA-Z0-9()]", "-", channel_label)
+        histocat_img_names.append(
+            f"{channel_label or channel_name}_{channel_name}.tiff"
+        )
+    return histocat_img_names
 
 
 def _extract_schema(mcd_file_handle: MCDFile, schema_xml_file: Path) -> bool:
     try:
-        with schema_xml_file.open("w") as f:
-            f.write(mcd_file_handle.schema_xml)
+        with _stage("schema_extraction", file=mcd_file_handle.path.name) as event:
+            with atomic_file(schema_xml_file) as temp_schema_xml_file:
+                with temp_schema_xml_file.open("w") as f:
+                    f.write(mcd_file_handle.schema_xml)
+            _set_bytes_written(event, schema_xml_file)
         return True
     except Exception as e:
         logging.error(
@@ -209,13 +876,64 @@ def _extract_schema(mcd_file_handle: MCDFile, schema_xml_file: Path) -> bool:
         return False
 
 
+def _extract_overview_images_job(
+    mcd_file: Union[str, PathLike],
+    acquisition_dir: Path,
+    overview_images: str,
+    thumbnail_size: int,
+) -> None:
+    try:
+        with MCDFile(mcd_file) as f_mcd:
+            _extract_overview_images(
+                f_mcd, acquisition_dir, overview_images, thumbnail_size
+            )
+    except Exception as e:
+        logging.error(f"Error reading file {Path(mcd_file).name}: {e}")
+
+
+def _extract_overview_images(
+    mcd_file_handle: MCDFile,
+    acquisition_dir: Path,
+    overview_images: str,
+    thumbnail_size: int,
+) -> None:
+    for slide in mcd_file_handle.slides:
+        slide_stem = f"{mcd_file_handle.path.stem}_s{slide.id}"
+        _extract_slide(
+            mcd_file_handle,
+            slide,
+            acquisition_dir / f"{slide_stem}_slide",
+            overview_images=overview_images,
+            thumbnail_size=thumbnail_size,
+        )
+        for panorama in slide.panoramas:
+            _extract_panorama(
+                mcd_file_handle,
+                panorama,
+                acquisition_dir / f"{slide_stem}_p{panorama.id}_pano",
+                overview_images=overview_images,
+                thumbnail_size=thumbnail_size,
+            )
+
+
 def _extract_slide(
-    mcd_file_handle: MCDFile, slide: Slide, slide_img_file: Path
+    mcd_file_handle: MCDFile,
+    slide: Slide,
+    slide_img_file_base: Path,
+    overview_images: str = "png",
+    thumbnail_size: int = 1024,
 ) -> bool:
     try:
-        slide_img = mcd_file_handle.read_slide(slide)
-        if slide_img is not None:
-            imageio.imwrite(slide_img_file, slide_img, compress_level=1)
+        with _stage(
+            "slide_extraction", file=mcd_file_handle.path.name, slide=slide.id
+        ) as event:
+            slide_img = mcd_file_handle.read_slide(slide)
+            if slide_img is not None:
+                event["bytes_read"] = slide_img.nbytes
+                slide_img_file = _write_overview_image(
+                    slide_img, slide_img_file_base, overview_images, thumbnail_size
+                )
+                _set_bytes_written(event, slide_img_file)
         return True
     except Exception as e:
         logging.error(
@@ -225,11 +943,24 @@ def _extract_slide(
 
 
 def _extract_panorama(
-    mcd_file_handle: MCDFile, panorama: Panorama, panorama_img_file: Path
+    mcd_file_handle: MCDFile,
+    panorama: Panorama,
+    panorama_img_file_base: Path,
+    overview_images: str = "png",
+    thumbnail_size: int = 1024,
 ) -> bool:
     try:
-        panorama_img = mcd_file_handle.read_panorama(panorama)
-        imageio.imwrite(panorama_img_file, panorama_img, compress_level=1)
+        with _stage(
+            "panorama_extraction",
+            file=mcd_file_handle.path.name,
+            panorama=panorama.id,
+        ) as event:
+            panorama_img = mcd_file_handle.read_panorama(panorama)
+            event["bytes_read"] = panorama_img.nbytes
+            panorama_img_file = _write_overview_image(
+                panorama_img, panorama_img_file_base, overview_images, thumbnail_size
+            )
+            _set_bytes_written(event, panorama_img_file)
         return True
     except Exception as e:
         logging.error(
@@ -239,28 +970,424 @@ def _extract_panorama(
         return False
 
 
+def _write_overview_image(
+    img: np.ndarray, img_file_base: Path, overview_images: str, thumbnail_size: int
+) -> Path:
+    if overview_images == "pyramid":
+        img_file = img_file_base.with_name(f"{img_file_base.name}.tiff")
+        with atomic_file(img_file) as temp_img_file:
+            _write_pyramid_tiff(img, temp_img_file)
+        return img_file
+    if overview_images == "thumbnail":
+        img = _downsample_overview_img(img, -(-max(img.shape[:2]) // thumbnail_size))
+        img_file = img_file_base.with_name(f"{img_file_base.name}_thumbnail.png")
+    else:
+        img_file = img_file_base.with_name(f"{img_file_base.name}.png")
+    with atomic_file(img_file) as temp_img_file:
+        imageio.imwrite(temp_img_file, img, compress_level=1)
+    return img_file
+
+
+def _write_pyramid_tiff(img: np.ndarray, img_file: Path, tile_size: int = 256) -> None:
+    # the full-resolution image is followed by sub-resolution images downsampled
+    # by a factor of two each, until they fit into a single tile
+    level_imgs = []
+    level_img = img
+    while max(level_img.shape[:2]) > tile_size:
+        level_img = _downsample_overview_img(level_img, 2)
+        level_imgs.append(level_img)
+    write_kwargs = {
+        "tile": (tile_size, tile_size),
+        "compression": "zlib",
+        "photometric": "rgb" if img.ndim == 3 else "minisblack",
+        "metadata": None,
+    }
+    with tifffile.TiffWriter(img_file, bigtiff=img.nbytes > 2**32 - 2**25) as writer:
+        writer.write(img, subifds=len(level_imgs), **write_kwargs)
+        for level_img in level_imgs:
+            writer.write(level_img, subfiletype=1, **write_kwargs)
+
+
+def _downsample_overview_img(img: np.ndarray, factor: int) -> np.ndarray:
+    if factor <= 1:
+        return img
+    # block mean, with incomplete blocks at the image border cropped
+    height = max(1, img.shape[0] // factor)
+    width = max(1, img.shape[1] // factor)
+    factor_y = min(factor, img.shape[0])
+    factor_x = min(factor, img.shape[1])
+    img = img[: height * factor_y, : width * factor_x]
+    blocks = img.reshape((height, factor_y, width, factor_x) + img.shape[2:])
+    mean_img = blocks.mean(axis=(1, 3))
+    if np.issubdtype(img.dtype, np.integer):
+        mean_img = np.rint(mean_img)
+    return mean_img.astype(img.dtype)
+
+
+def _get_acquisition(
+    mcd_file_handle: MCDFile, slide_id: int, acquisition_id: int
+) -> Acquisition:
+    slide = next(slide for slide in mcd_file_handle.slides if slide.id == slide_id)
+    return next(
+        acquisition
+        for acquisition in slide.acquisitions
+        if acquisition.id == acquisition_id
+    )
+
+
+def _extract_acquisition_with_txt_fallback(
+    mcd_file_handle: MCDFile,
+    acquisition: Acquisition,
+    acquisition_img_file: Path,
+    acquisition_txt_files: Optional[Sequence[Union[str, PathLike]]] = None,
+    analysis_stacks: Optional[Sequence[AnalysisStack]] = None,
+    hpf: Optional[float] = None,
+    histocat_dir: Optional[Union[str, PathLike]] = None,
+    tile_size: Optional[int] = None,
+    compression: Optional[str] = None,
+    predictor: bool = False,
+    dtype: Optional[str] = None,
+    embed_schema: bool = True,
+    txt_cache_dir: Optional[Union[str, PathLike]] = None,
+    txt_file_sha256: Optional[str] = None,
+    acquisition_img_future: Optional["Future[np.ndarray]"] = None,
+) -> Tuple[str, bool]:
+    acquisition_channels_file = acquisition_img_file.with_name(
+        acquisition_img_file.name[:-9] + ".csv"
+    )
+    acquisition_origin = "mcd"
+    acquisition_img = _extract_acquisition(
+        mcd_file_handle,
+        acquisition,
+        acquisition_img_file,
+        acquisition_channels_file,
+        tile_size=tile_size,
+        compression=compression,
+        predictor=predictor,
+        dtype=dtype,
+        embed_schema=embed_schema,
+        acquisition_img_future=acquisition_img_future,
+    )
+    txt_file = None
+    if acquisition_img is None and acquisition_txt_files is not None:
+        txt_file = _get_acquisition_txt_file(
+            mcd_file_handle, acquisition, acquisition_txt_files
+        )
+    if txt_file is not None:
+        logging.info(
+            f"Attempting to restore acquisition {acquisition.id} "
+            f"from file {Path(txt_file).name}"
+        )
+        with TXTFile(txt_file) as f_txt:
+            acquisition_origin = "txt"
+            acquisition_img = _extract_acquisition_from_txt_file(
+                mcd_file_handle,
+                f_txt,
+                acquisition,
+                acquisition_img_file,
+                acquisition_channels_file,
+                tile_size=tile_size,
+                compression=compression,
+                predictor=predictor,
+                dtype=dtype,
+                embed_schema=embed_schema,
+                txt_cache_dir=txt_cache_dir,
+                txt_file_sha256=txt_file_sha256,
+            )
+    if acquisition_img is None:
+        return acquisition_origin, False
+    # derived images are written from the acquisition image in memory, instead
+    # of reading the written .ome.tiff file again
+    acquisition_channels = pd.DataFrame(
+        data={
+            "channel_name": acquisition.channel_names,
+            "channel_label": acquisition.channel_labels,
+        }
+    )
+    if analysis_stacks is not None and len(analysis_stacks) > 0:
+        _write_analysis_stacks(
+            acquisition_img,
+            acquisition_channels["channel_name"].tolist(),
+            acquisition_img_file.name[:-9],
+            analysis_stacks,
+            hpf=hpf,
+            compression=compression,
+            predictor=predictor,
+        )
+    if histocat_dir is not None:
+        _write_histocat_images(
+            acquisition_img,
+            acquisition_channels,
+            Path(histocat_dir) / acquisition_img_file.name[:-9],
+            compression=compression,
+            predictor=predictor,
+        )
+    return acquisition_origin, True
+
+
+def _index_txt_files(
+    txt_files: Sequence[Union[str, PathLike]],
+) -> Dict[str, List[Union[str, PathLike]]]:
+    # .txt files are indexed by their acquisition ID suffix once per .mcd file,
+    # instead of scanning all .txt files for each acquisition
+    txt_file_index: Dict[str, List[Union[str, PathLike]]] = {}
+    for txt_file in txt_files:
+        txt_file_stem = Path(txt_file).stem
+        if "_" in txt_file_stem:
+            txt_file_suffix = txt_file_stem.rsplit("_", 1)[1]
+            txt_file_index.setdefault(txt_file_suffix, []).append(txt_file)
+    return txt_file_index
+
+
+def _get_acquisition_txt_file(
+    mcd_file_handle: MCDFile,
+    acquisition: Acquisition,
+    acquisition_txt_files: Sequence[Union[str, PathLike]],
+) -> Optional[Union[str, PathLike]]:
+    if len(acquisition_txt_files) > 1:
+        acquisition_txt_file_names = [Path(f).name for f in acquisition_txt_files]
+        logging.warning(
+            f"Multiple .txt files found for acquisition "
+            f"{acquisition.id} in {mcd_file_handle.path.name}: "
+            f"{acquisition_txt_file_names}"
+        )
+    if len(acquisition_txt_files) == 1:
+        return acquisition_txt_files[0]
+    return None
+
+
+# one MCD file handle per worker process, opened by the pool initializer; the
+# (read-only) handle is not closed explicitly, but released by the operating
+# system when the worker process exits, as pool workers skip atexit handlers
+_worker_mcd_file_handle: Optional[MCDFile] = None
+
+
+def _init_mcd_file_worker(
+    mcd_file: Union[str, PathLike], sinks: Sequence[Callable]
+) -> None:
+    global _worker_mcd_file_handle
+    _set_sinks(sinks)
+    _worker_mcd_file_handle = MCDFile(mcd_file)
+    _worker_mcd_file_handle.open()
+
+
+def _extract_acquisition_job(
+    slide_id: int,
+    acquisition_id: int,
+    acquisition_img_file: Path,
+    acquisition_txt_files: Optional[Sequence[Union[str, PathLike]]] = None,
+    analysis_stacks: Optional[Sequence[AnalysisStack]] = None,
+    hpf: Optional[float] = None,
+    histocat_dir: Optional[Union[str, PathLike]] = None,
+    tile_size: Optional[int] = None,
+    compression: Optional[str] = None,
+    predictor: bool = False,
+    dtype: Optional[str] = None,
+    embed_schema: bool = True,
+    txt_cache_dir: Optional[Union[str, PathLike]] = None,
+) -> Tuple[str, bool]:
+    assert _worker_mcd_file_handle is not None
+    acquisition = _get_acquisition(_worker_mcd_file_handle, slide_id, acquisition_id)
+    return _extract_acquisition_with_txt_fallback(
+        _worker_mcd_file_handle,
+        acquisition,
+        acquisition_img_file,
+        acquisition_txt_files=acquisition_txt_files,
+        analysis_stacks=analysis_stacks,
+        hpf=hpf,
+        histocat_dir=histocat_dir,
+        tile_size=tile_size,
+        compression=compression,
+        predictor=predictor,
+        dtype=dtype,
+        embed_schema=embed_schema,
+        txt_cache_dir=txt_cache_dir,
+    )
+
+
+def _decode_txt_file_job(
+    txt_file: Union[str, PathLike], txt_cache_dir: Union[str, PathLike]
+) -> str:
+    # the checksum is returned, such that the .txt file is not hashed again when
+    # loading the cached acquisition
+    txt_file_sha256 = _get_txt_file_sha256(txt_file)
+    read_txt_acquisition(
+        txt_file, txt_cache_dir=txt_cache_dir, txt_file_sha256=txt_file_sha256
+    )
+    return txt_file_sha256
+
+
+def _get_decoded_txt_file_sha256(
+    txt_future: Optional["Future[str]"],
+) -> Optional[str]:
+    if txt_future is None:
+        return None
+    wait([txt_future])
+    if txt_future.cancelled() or txt_future.exception() is not None:
+        # errors are reported when restoring the acquisition
+        return None
+    return txt_future.result()
+
+
+def _extract_acquisitions_pipelined(
+    mcd_file_handle: MCDFile,
+    acquisitions: Sequence[Acquisition],
+    acquisition_img_files: Dict[int, Path],
+    pipeline_depth: int,
+    txt_file_index: Optional[Dict[str, List[Union[str, PathLike]]]] = None,
+    txt_futures: Optional[Dict[int, "Future[str]"]] = None,
+    analysis_stacks: Optional[Sequence[AnalysisStack]] = None,
+    hpf: Optional[float] = None,
+    histocat_dir: Optional[Union[str, PathLike]] = None,
+    compression: Optional[str] = None,
+    predictor: bool = False,
+    dtype: Optional[str] = None,
+    embed_schema: bool = True,
+    txt_cache_dir: Optional[Union[str, PathLike]] = None,
+) -> Iterator[Tuple[str, bool]]:
+    # acquisitions are read from the file handle by a reader thread, converted
+    # by an encoder thread and written by a writer thread, such that reading
+    # acquisition N+1 overlaps with writing acquisition N; the number of
+    # acquisitions in flight (and thus held in memory) is bounded by the depth
+    with ThreadPoolExecutor(max_workers=1) as reader, ThreadPoolExecutor(
+        max_workers=1
+    ) as encoder, ThreadPoolExecutor(max_workers=1) as writer:
+        pipeline_futures: Deque[Tuple[Future, Future, Future[Tuple[str, bool]]]]
+        pipeline_futures = deque()
+        try:
+            for acquisition in acquisitions:
+                if len(pipeline_futures) >= pipeline_depth:
+                    yield pipeline_futures.popleft()[2].result()
+                acquisition_img_file = acquisition_img_files[acquisition.id]
+                read_future = reader.submit(
+                    _read_mcd_acquisition,
+                    mcd_file_handle,
+                    acquisition,
+                    acquisition_img_file,
+                )
+                encode_future = encoder.submit(
+                    _encode_acquisition_job,
+                    mcd_file_handle,
+                    acquisition,
+                    read_future,
+                    dtype=dtype,
+                )
+                write_future = writer.submit(
+                    _write_acquisition_job,
+                    (txt_futures or {}).get(acquisition.id),
+                    mcd_file_handle,
+                    acquisition,
+                    acquisition_img_file,
+                    acquisition_txt_files=(txt_file_index or {}).get(
+                        str(acquisition.id), []
+                    ),
+                    analysis_stacks=analysis_stacks,
+                    hpf=hpf,
+                    histocat_dir=histocat_dir,
+                    compression=compression,
+                    predictor=predictor,
+                    dtype=dtype,
+                    embed_schema=embed_schema,
+                    txt_cache_dir=txt_cache_dir,
+                    acquisition_img_future=encode_future,
+                )
+                pipeline_futures.append((read_future, encode_future, write_future))
+            while len(pipeline_futures) > 0:
+                yield pipeline_futures.popleft()[2].result()
+        finally:
+            for futures in pipeline_futures:
+                for future in futures:
+                    future.cancel()
+
+
+def _encode_acquisition_job(
+    mcd_file_handle: MCDFile,
+    acquisition: Acquisition,
+    read_future: "Future[np.ndarray]",
+    dtype: Optional[str] = None,
+) -> np.ndarray:
+    acquisition_img = read_future.result()
+    if dtype is not None:
+        acquisition_img = _convert_to_integer_dtype(
+            acquisition_img,
+            dtype,
+            f"acquisition {acquisition.id} from file {mcd_file_handle.path.name}",
+        )
+    return acquisition_img
+
+
+def _write_acquisition_job(
+    txt_future: Optional["Future[str]"], *args, **kwargs
+) -> Tuple[str, bool]:
+    return _extract_acquisition_with_txt_fallback(
+        *args, txt_file_sha256=_get_decoded_txt_file_sha256(txt_future), **kwargs
+    )
+
+
 def _extract_acquisition(
     mcd_file_handle: MCDFile,
     acquisition: Acquisition,
     acquisition_img_file: Path,
     acquisition_channels_file: Path,
-) -> bool:
+    tile_size: Optional[int] = None,
+    compression: Optional[str] = None,
+    predictor: bool = False,
+    dtype: Optional[str] = None,
+    embed_schema: bool = True,
+    acquisition_img_future: Optional["Future[np.ndarray]"] = None,
+) -> Optional[Union[np.ndarray, "_McdChannelStack"]]:
     try:
-        acquisition_img = mcd_file_handle.read_acquisition(acquisition)
+        acquisition_img: Union[np.ndarray, _McdChannelStack]
+        if tile_size is not None:
+            # tiled images are read and written one channel at a time
+            acquisition_img = _McdChannelStack(
+                mcd_file_handle, acquisition, dtype=dtype
+            )
+        elif acquisition_img_future is not None:
+            # read and converted ahead of time by the extraction pipeline
+            acquisition_img = acquisition_img_future.result()
+        else:
+            acquisition_img = _read_mcd_acquisition(
+                mcd_file_handle, acquisition, acquisition_img_file
+            )
+            if dtype is not None:
+                acquisition_img = _convert_to_integer_dtype(
+                    acquisition_img,
+                    dtype,
+                    f"acquisition {acquisition.id} "
+                    f"from file {mcd_file_handle.path.name}",
+                )
         _write_acquisition_image(
             mcd_file_handle,
             acquisition,
             acquisition_img,
             acquisition_img_file,
             acquisition_channels_file,
+            tile_size=tile_size,
+            compression=compression,
+            predictor=predictor,
+            embed_schema=embed_schema,
         )
-        return True
+        return acquisition_img
     except Exception as e:
         logging.error(
             f"Error reading acquisition {acquisition.id} "
             f"from file {mcd_file_handle.path.name}: {e}"
         )
-        return False
+        return None
+
+
+def _read_mcd_acquisition(
+    mcd_file_handle: MCDFile, acquisition: Acquisition, acquisition_img_file: Path
+) -> np.ndarray:
+    with _stage(
+        "acquisition_read",
+        file=mcd_file_handle.path.name,
+        acquisition=acquisition_img_file.name[:-9],
+    ) as event:
+        acquisition_img = mcd_file_handle.read_acquisition(acquisition)
+        event["bytes_read"] = acquisition_img.nbytes
+    return acquisition_img
 
 
 def _extract_acquisition_from_txt_file(
@@ -269,53 +1396,905 @@ def _extract_acquisition_from_txt_file(
     acquisition: Acquisition,
     acquisition_img_file: Path,
     acquisition_channels_file: Path,
-) -> bool:
+    tile_size: Optional[int] = None,
+    compression: Optional[str] = None,
+    predictor: bool = False,
+    dtype: Optional[str] = None,
+    embed_schema: bool = True,
+    txt_cache_dir: Optional[Union[str, PathLike]] = None,
+    txt_file_sha256: Optional[str] = None,
+) -> Optional[np.ndarray]:
     try:
-        acquisition_img = txt_file_handle.read_acquisition()
+        with _stage(
+            "acquisition_read",
+            file=txt_file_handle.path.name,
+            acquisition=acquisition_img_file.name[:-9],
+        ) as event:
+            acquisition_img = read_txt_acquisition(
+                txt_file_handle.path,
+                txt_cache_dir=txt_cache_dir,
+                txt_file_sha256=txt_file_sha256,
+            )
+            event["bytes_read"] = acquisition_img.nbytes
+        if dtype is not None:
+            acquisition_img = _convert_to_integer_dtype(
+                acquisition_img,
+                dtype,
+                f"acquisition {acquisition.id} from file {txt_file_handle.path.name}",
+            )
         _write_acquisition_image(
             mcd_file_handle,
             acquisition,
             acquisition_img,
             acquisition_img_file,
             acquisition_channels_file,
+            tile_size=tile_size,
+            compression=compression,
+            predictor=predictor,
+            embed_schema=embed_schema,
         )
-        return True
+        return acquisition_img
     except Exception as e:
         logging.error(
             f"Error restoring acquisition {acquisition.id} "
             f"for file {mcd_file_handle.path.name} from file {txt_file_handle.path}: "
             f"{e}"
         )
-        return False
+        return None
 
 
-def _write_acquisition_image(
+def _read_acquisition_with_txt_fallback(
     mcd_file_handle: MCDFile,
     acquisition: Acquisition,
+    acquisition_txt_files: Optional[Sequence[Union[str, PathLike]]] = None,
+    txt_cache_dir: Optional[Union[str, PathLike]] = None,
+) -> Tuple[str, Optional[np.ndarray]]:
+    try:
+        return "mcd", mcd_file_handle.read_acquisition(acquisition)
+    except Exception as e:
+        logging.error(
+            f"Error reading acquisition {acquisition.id} "
+            f"from file {mcd_file_handle.path.name}: {e}"
+        )
+    txt_file = None
+    if acquisition_txt_files is not None:
+        txt_file = _get_acquisition_txt_file(
+            mcd_file_handle, acquisition, acquisition_txt_files
+        )
+    if txt_file is None:
+        return "mcd", None
+    logging.info(
+        f"Attempting to restore acquisition {acquisition.id} "
+        f"from file {Path(txt_file).name}"
+    )
+    try:
+        return "txt", read_txt_acquisition(txt_file, txt_cache_dir=txt_cache_dir)
+    except Exception as e:
+        logging.error(
+            f"Error restoring acquisition {acquisition.id} "
+            f"for file {mcd_file_handle.path.name} from file {txt_file}: {e}"
+        )
+        return "txt", None
+
+
+def _write_hdf5_acquisition(
+    f_hdf5: "h5py.Group",
+    acquisition_img_stem: str,
+    acquisition: Acquisition,
     acquisition_img: np.ndarray,
+    chunk_size: Optional[int] = None,
+    compression: Optional[str] = "gzip",
+) -> None:
+    num_channels, height, width = acquisition_img.shape
+    # one chunk per channel (or per channel tile), such that single channels
+    # can be read without decompressing the other channels
+    chunks = (1, height, width)
+    if chunk_size is not None:
+        chunks = (1, min(chunk_size, height), min(chunk_size, width))
+    dataset = f_hdf5.create_dataset(
+        f"acquisitions/{acquisition_img_stem}",
+        data=acquisition_img,
+        chunks=chunks,
+        compression=compression,
+    )
+    dataset.attrs["channel_name"] = acquisition.channel_names
+    dataset.attrs["channel_label"] = [
+        channel_label or "" for channel_label in acquisition.channel_labels
+    ]
+
+
+def _write_acquisition_image(
+    mcd_file_handle: MCDFile,
+    acquisition: Acquisition,
+    acquisition_img: Union[np.ndarray, "_McdChannelStack"],
     acquisition_img_file: Path,
     acquisition_channels_file: Path,
+    tile_size: Optional[int] = None,
+    compression: Optional[str] = None,
+    predictor: bool = False,
+    embed_schema: bool = True,
 ) -> None:
+    xml_annotation = _get_mcd_xml_annotation(mcd_file_handle, embed_schema)
     channel_labels_or_names = [
         channel_label or channel_name
         for channel_name, channel_label in zip(
             acquisition.channel_names, acquisition.channel_labels
         )
     ]
-    xtiff.to_tiff(
-        acquisition_img,
-        acquisition_img_file,
-        ome_xml_fun=get_acquisition_ome_xml,
-        channel_names=channel_labels_or_names,
-        channel_fluors=acquisition.channel_names,
-        xml_metadata=mcd_file_handle.schema_xml.replace("\r\n", ""),
+    # in tiled mode, channels are read from the .mcd file while writing
+    with _stage(
+        "ome_tiff_write",
+        file=mcd_file_handle.path.name,
+        acquisition=acquisition_img_file.name[:-9],
+    ) as event:
+        with atomic_file(acquisition_img_file) as temp_acquisition_img_file:
+            if tile_size is not None or compression is not None or predictor:
+                _write_ome_tiff(
+                    acquisition_img,
+                    temp_acquisition_img_file,
+                    tile_size=tile_size,
+                    compression=compression,
+                    predictor=predictor,
+                    image_name=acquisition_img_file.name,
+                    channel_names=channel_labels_or_names,
+                    channel_fluors=acquisition.channel_names,
+                    xml_annotation=xml_annotation,
+                )
+            else:
+                xtiff.to_tiff(
+                    acquisition_img,
+                    temp_acquisition_img_file,
+                    image_name=acquisition_img_file.name,
+                    ome_xml_fun=_get_acquisition_ome_xml,
+                    channel_names=channel_labels_or_names,
+                    channel_fluors=acquisition.channel_names,
+                    xml_annotation=xml_annotation,
+                )
+        with atomic_file(acquisition_channels_file) as temp_acquisition_channels_file:
+            pd.DataFrame(
+                data={
+                    "channel_name": acquisition.channel_names,
+                    "channel_label": acquisition.channel_labels,
+                }
+            ).to_csv(temp_acquisition_channels_file, index=False)
+        _set_bytes_written(event, acquisition_img_file, acquisition_channels_file)
+
+
+# the normalized schema of each .mcd file is serialized into an OME-XML
+# annotation once, instead of for every acquisition written from the file
+_mcd_xml_annotations: "WeakKeyDictionary[MCDFile, Dict[bool, bytes]]" = (
+    WeakKeyDictionary()
+)
+
+
+def _get_mcd_xml_annotation(mcd_file_handle: MCDFile, embed_schema: bool) -> bytes:
+    xml_annotations = _mcd_xml_annotations.setdefault(mcd_file_handle, {})
+    if embed_schema not in xml_annotations:
+        if embed_schema:
+            xml_annotation_elem = _get_xml_annotation_elem(
+                mcd_file_handle.schema_xml.replace("\r\n", ""), "MCD-XML"
+            )
+        else:
+            # the schema is referenced by the name of the file written by
+            # extract_mcd_file next to the acquisition images
+            xml_annotation_elem = _get_xml_annotation_elem(
+                f"{mcd_file_handle.path.stem}_schema.xml", "MCD-XML-File"
+            )
+        xml_annotations[embed_schema] = ET.tostring(
+            xml_annotation_elem, encoding="unicode"
+        ).encode("utf-8")
+    return xml_annotations[embed_schema]
+
+
+class _SerializedOmeXml:
+    def __init__(self, ome_xml: ET.ElementTree, xml_annotation: bytes) -> None:
+        self._ome_xml = ome_xml
+        self._xml_annotation = xml_annotation
+
+    def write(self, file: BinaryIO, **kwargs) -> None:
+        with BytesIO() as buffer:
+            self._ome_xml.write(buffer, **kwargs)
+            ome_xml = buffer.getvalue()
+        # the pre-serialized annotation is the last child of the root element
+        end_index = ome_xml.rindex(b"</OME>")
+        file.write(ome_xml[:end_index])
+        file.write(self._xml_annotation)
+        file.write(ome_xml[end_index:])
+
+
+def _get_acquisition_ome_xml(
+    *args, xml_annotation: bytes, **kwargs
+) -> _SerializedOmeXml:
+    return _SerializedOmeXml(get_acquisition_ome_xml(*args, **kwargs), xml_annotation)
+
+
+def _write_ome_tiff(
+    img: Union[np.ndarray, "_McdChannelStack"],
+    img_file: Path,
+    tile_size: Optional[int] = None,
+    compression: Optional[str] = None,
+    predictor: bool = False,
+    **ome_xml_kwargs,
+) -> None:
+    num_channels, height, width = img.shape
+    # the OME-XML only depends on the image shape and data type
+    ome_xml = _get_acquisition_ome_xml(
+        np.broadcast_to(img.dtype.type(0), (1, 1, num_channels, height, width, 1)),
+        big_endian=False,
+        pixel_size=None,
+        pixel_depth=None,
+        interleaved=True,
+        **ome_xml_kwargs,
     )
-    pd.DataFrame(
-        data={
-            "channel_name": acquisition.channel_names,
-            "channel_label": acquisition.channel_labels,
-        }
-    ).to_csv(acquisition_channels_file, index=False)
+    with BytesIO() as description_buffer:
+        ome_xml.write(description_buffer, encoding="utf-8", xml_declaration=True)
+        description = description_buffer.getvalue()
+
+    # images are written one channel (or tile) at a time
+    def iter_pages_or_tiles() -> Iterator[np.ndarray]:
+        for channel_index in range(num_channels):
+            if tile_size is not None and isinstance(img, _McdChannelStack):
+                # large acquisitions are read one row of tiles at a time
+                for tile_row_img in img.iter_row_bands(channel_index, tile_size):
+                    for x in range(0, width, tile_size):
+                        yield tile_row_img[:, x : x + tile_size]
+                continue
+            channel_img = np.asarray(img[channel_index], dtype=img.dtype)
+            if tile_size is None:
+                yield channel_img
+                continue
+            for y in range(0, height, tile_size):
+                for x in range(0, width, tile_size):
+                    yield channel_img[y : y + tile_size, x : x + tile_size]
+
+    with tifffile.TiffWriter(
+        img_file,
+        bigtiff=num_channels * height * width * img.dtype.itemsize > 2**32 - 2**25,
+    ) as writer:
+        writer.write(
+            data=iter_pages_or_tiles(),
+            shape=(num_channels, height, width),
+            dtype=img.dtype,
+            tile=(tile_size, tile_size) if tile_size is not None else None,
+            compression=compression,
+            predictor=predictor,
+            photometric="minisblack",
+            description=description,
+            metadata=None,
+        )
+
+
+def _check_compression(
+    compression: Optional[str], predictor: bool = False, dtype: Optional[str] = None
+) -> None:
+    # compression arguments are checked up front, as tifffile would only fail
+    # when writing the images, i.e. separately for every acquisition
+    if predictor and compression is None:
+        raise ValueError("Predictor requires compression")
+    if find_spec("imagecodecs") is None:
+        if (
+            compression is not None
+            and compression.lower() not in TIFF_BUILTIN_COMPRESSIONS
+        ):
+            raise ValueError(
+                f"Compression '{compression}' requires the 'imagecodecs' package"
+            )
+        if predictor and dtype is None:
+            raise ValueError(
+                "Predictor for floating point images requires the 'imagecodecs' "
+                "package, or an integer data type (dtype)"
+            )
+
+
+def _convert_to_integer_dtype(img: np.ndarray, dtype: str, img_name: str) -> np.ndarray:
+    converted_img, rounded, clipped = _round_to_integer_dtype(img, dtype)
+    _warn_integer_dtype_conversion(img_name, dtype, rounded, clipped)
+    return converted_img
+
+
+def _round_to_integer_dtype(
+    img: np.ndarray, dtype: str
+) -> Tuple[np.ndarray, bool, bool]:
+    # raw counts are integers stored as floating point numbers by the instrument
+    dtype_info = np.iinfo(dtype)
+    converted_img = np.rint(img)
+    rounded = not np.array_equal(converted_img, img)
+    clipped = bool(
+        np.any(converted_img < dtype_info.min) or np.any(converted_img > dtype_info.max)
+    )
+    if clipped:
+        np.clip(converted_img, dtype_info.min, dtype_info.max, out=converted_img)
+    return converted_img.astype(dtype), rounded, clipped
+
+
+def _warn_integer_dtype_conversion(
+    img_name: str, dtype: str, rounded: bool, clipped: bool
+) -> None:
+    if rounded:
+        logging.warning(f"Rounding non-integer values of {img_name} to {dtype}")
+    if clipped:
+        logging.warning(f"Clipping values of {img_name} to the range of {dtype}")
+
+
+class _McdChannelStack:
+    def __init__(
+        self,
+        mcd_file_handle: MCDFile,
+        acquisition: Acquisition,
+        dtype: Optional[str] = None,
+    ) -> None:
+        if not _is_acquisition_data_valid(mcd_file_handle, acquisition):
+            raise IOError(
+                f"MCD file '{mcd_file_handle.path.name}' corrupted: "
+                "invalid acquisition data"
+            )
+        self._mcd_file_handle = mcd_file_handle
+        self._acquisition = acquisition
+        self._integer_dtype = dtype
+        self.shape: Tuple[int, ...] = (
+            acquisition.num_channels,
+            int(acquisition.metadata["MaxY"]),
+            int(acquisition.metadata["MaxX"]),
+        )
+        self.dtype = np.dtype(dtype or np.float32)
+        # single channels are read in groups of consecutive channels that fit
+        # into MCD_CHANNEL_GROUP_SIZE bytes, as every read has to go through the
+        # whole (pixel-interleaved) acquisition data
+        self._group_size = max(
+            1, MCD_CHANNEL_GROUP_SIZE // max(1, self.shape[1] * self.shape[2] * 4)
+        )
+        self._group_start = 0
+        self._group_img: Optional[np.ndarray] = None
+
+    def __getitem__(self, key: Union[int, Sequence[int]]) -> np.ndarray:
+        if isinstance(key, (int, np.integer)):
+            key = int(key)
+            if (
+                self._group_img is None
+                or key < self._group_start
+                or key >= self._group_start + len(self._group_img)
+            ):
+                self._group_img = None
+                self._group_start = key
+                self._group_img = self[
+                    list(range(key, min(key + self._group_size, self.shape[0])))
+                ]
+            return self._group_img[key - self._group_start]
+        channels = [int(channel) for channel in key]
+        img = self._read_rows(channels, 0, self.shape[1])
+        if self._integer_dtype is not None:
+            img = _convert_to_integer_dtype(img, self._integer_dtype, self._img_name)
+        return img
+
+    def iter_row_bands(self, channel: int, band_height: int) -> Iterator[np.ndarray]:
+        # channel images larger than a channel group are not read as a whole,
+        # but in bands of rows, such that the memory usage does not depend on
+        # the size of the acquisition
+        height = self.shape[1]
+        if self._group_size > 1:
+            channel_img = self[channel]
+            for y in range(0, height, band_height):
+                yield channel_img[y : y + band_height]
+            return
+        rounded = clipped = False
+        for y in range(0, height, band_height):
+            band_img = self._read_rows([channel], y, min(y + band_height, height))[0]
+            if self._integer_dtype is not None:
+                band_img, band_rounded, band_clipped = _round_to_integer_dtype(
+                    band_img, self._integer_dtype
+                )
+                rounded |= band_rounded
+                clipped |= band_clipped
+            yield band_img
+        if self._integer_dtype is not None:
+            _warn_integer_dtype_conversion(
+                f"channel {channel} of {self._img_name}",
+                self._integer_dtype,
+                rounded,
+                clipped,
+            )
+
+    @property
+    def _img_name(self) -> str:
+        return (
+            f"acquisition {self._acquisition.id} "
+            f"from file {self._mcd_file_handle.path.name}"
+        )
+
+    def _read_rows(
+        self, channels: Sequence[int], y_start: int, y_end: int
+    ) -> np.ndarray:
+        # the acquisition data is read from the file directly, instead of using
+        # MCDFile.read_acquisition, which maps the whole acquisition data and
+        # creates coordinate arrays for all pixels; pixels are stored row by
+        # row as (X, Y, Z, channels...) values
+        num_channels, _, width = self.shape
+        if any(channel < 0 or channel >= num_channels for channel in channels):
+            raise ValueError(f"Invalid channel indices: {channels}")
+        data_start_offset = int(self._acquisition.metadata["DataStartOffset"])
+        data_end_offset = int(self._acquisition.metadata["DataEndOffset"])
+        num_values = num_channels + 3
+        num_pixels = (data_end_offset - data_start_offset) // (num_values * 4)
+        img = np.zeros((len(channels), y_end - y_start, width), dtype=np.float32)
+        # the pixel data is read in chunks of rows of at most MCD_ROW_CHUNK_SIZE
+        # bytes (for all channels), which bounds the memory usage for reading
+        chunk_height = max(1, MCD_ROW_CHUNK_SIZE // max(1, width * num_values * 4))
+        value_indices = [channel + 3 for channel in channels]
+        with self._mcd_file_handle.path.open("rb") as f:
+            for y in range(y_start, y_end, chunk_height):
+                chunk_start = min(y * width, num_pixels)
+                chunk_end = min(min(y + chunk_height, y_end) * width, num_pixels)
+                if chunk_start == chunk_end:
+                    break
+                chunk_data = np.empty(
+                    (chunk_end - chunk_start, num_values), dtype=np.float32
+                )
+                f.seek(data_start_offset + chunk_start * num_values * 4)
+                if f.readinto(memoryview(chunk_data).cast("B")) != chunk_data.nbytes:
+                    raise IOError(
+                        f"MCD file '{self._mcd_file_handle.path.name}' corrupted: "
+                        "invalid data size"
+                    )
+                xs = chunk_data[:, 0].astype(np.intp)
+                ys = chunk_data[:, 1].astype(np.intp)
+                if (
+                    np.any(xs < 0)
+                    or np.any(xs >= width)
+                    or np.any(ys < y)
+                    or np.any(ys >= y_end)
+                ):
+                    raise IOError(
+                        f"MCD file '{self._mcd_file_handle.path.name}' corrupted: "
+                        f"pixels of acquisition {self._acquisition.id} are not "
+                        "stored row by row"
+                    )
+                img[:, ys - y_start, xs] = chunk_data[:, value_indices].T
+        return img
+
+
+class _TiffPageStack:
+    def __init__(self, tiff: tifffile.TiffFile) -> None:
+        self._tiff = tiff
+        self.shape: Tuple[int, ...] = tiff.series[0].shape
+
+    def __getitem__(self, key: Union[int, Sequence[int]]) -> np.ndarray:
+        return self._tiff.asarray(key=key, series=0)
+
+
+class _Hdf5ChannelStack:
+    def __init__(self, dataset: "h5py.Dataset") -> None:
+        self._dataset = dataset
+        self.shape: Tuple[int, ...] = dataset.shape
+
+    def __getitem__(self, key: Union[int, Sequence[int]]) -> np.ndarray:
+        if isinstance(key, (int, np.integer)):
+            return self._dataset[int(key)]
+        # h5py only supports increasing, unique indices
+        unique_channels, inverse = np.unique(np.asarray(key), return_inverse=True)
+        return self._dataset[unique_channels.tolist()][inverse]
+
+    def get_channels(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            data={
+                "channel_name": [
+                    _decode(channel_name)
+                    for channel_name in self._dataset.attrs["channel_name"]
+                ],
+                "channel_label": [
+                    _decode(channel_label) or None
+                    for channel_label in self._dataset.attrs["channel_label"]
+                ],
+            }
+        )
+
+
+def _decode(value: Union[str, bytes]) -> str:
+    if isinstance(value, bytes):
+        return value.decode()
+    return value
+
+
+def _iter_acquisition_channels(
+    acquisition_dir: Union[str, PathLike],
+) -> Iterator[Tuple[str, pd.DataFrame]]:
+    if Path(acquisition_dir).suffix == ".h5":
+        import h5py
+
+        with h5py.File(acquisition_dir, "r") as f_hdf5:
+            for acquisition_img_stem, dataset in f_hdf5.get("acquisitions", {}).items():
+                yield acquisition_img_stem, _Hdf5ChannelStack(dataset).get_channels()
+        return
+    for acquisition_img_file in sorted(Path(acquisition_dir).glob("[!.]*.ome.tiff")):
+        acquisition_channels_file = acquisition_img_file.with_name(
+            acquisition_img_file.name[:-9] + ".csv"
+        )
+        yield acquisition_img_file.name[:-9], pd.read_csv(acquisition_channels_file)
+
+
+def _get_mcd_file_channel_names(mcd_file_handle: MCDFile) -> Dict[str, Sequence[str]]:
+    return {
+        f"{mcd_file_handle.path.stem}_s{slide.id}_a{acquisition.id}_ac": (
+            acquisition.channel_names
+        )
+        for slide in mcd_file_handle.slides
+        for acquisition in slide.acquisitions
+    }
+
+
+@lru_cache(maxsize=None)
+def _get_channel_indices(channel_names: Tuple[str, ...]) -> Dict[str, int]:
+    # channel indices are resolved once per distinct channel layout; for
+    # duplicate channel names, the first channel is used
+    return {
+        channel_name: channel_index
+        for channel_index, channel_name in reversed(list(enumerate(channel_names)))
+    }
+
+
+def _get_missing_channel_names(
+    channel_names: Sequence[str], analysis_stacks: Sequence[AnalysisStack]
+) -> List[str]:
+    channel_indices = _get_channel_indices(tuple(channel_names))
+    return list(
+        dict.fromkeys(
+            channel_name
+            for analysis_stack in analysis_stacks
+            for channel_name in analysis_stack.analysis_channels
+            if channel_name not in channel_indices
+        )
+    )
+
+
+def _check_analysis_channels(
+    acquisition_channel_names: Dict[str, Sequence[str]],
+    analysis_stacks: Sequence[AnalysisStack],
+) -> None:
+    num_incompatible_acquisitions = 0
+    for acquisition_img_stem, channel_names in acquisition_channel_names.items():
+        missing_channel_names = _get_missing_channel_names(
+            channel_names, analysis_stacks
+        )
+        if len(missing_channel_names) > 0:
+            logging.error(
+                f"Channels missing in acquisition {acquisition_img_stem}: "
+                f"{missing_channel_names}"
+            )
+            num_incompatible_acquisitions += 1
+    if num_incompatible_acquisitions > 0:
+        raise ValueError(
+            f"Analysis channels missing in {num_incompatible_acquisitions} "
+            f"of {len(acquisition_channel_names)} acquisitions"
+        )
+
+
+def _iter_acquisition_imgs(
+    acquisition_dir: Union[str, PathLike],
+    acquisition_img_stems: Optional[Sequence[str]] = None,
+) -> Iterator[
+    Tuple[str, pd.DataFrame, Union[np.ndarray, _TiffPageStack, _Hdf5ChannelStack]]
+]:
+    if Path(acquisition_dir).suffix == ".h5":
+        import h5py
+
+        with h5py.File(acquisition_dir, "r") as f_hdf5:
+            datasets = f_hdf5.get("acquisitions", {})
+            if acquisition_img_stems is None:
+                acquisition_img_stems = list(datasets)
+            for acquisition_img_stem in acquisition_img_stems:
+                acquisition_img = _Hdf5ChannelStack(datasets[acquisition_img_stem])
+                acquisition_channels = acquisition_img.get_channels()
+                yield acquisition_img_stem, acquisition_channels, acquisition_img
+        return
+    acquisition_img_files: Iterable[Path] = Path(acquisition_dir).glob("[!.]*.ome.tiff")
+    if acquisition_img_stems is not None:
+        acquisition_img_files = [
+            _get_acquisition_img_file(acquisition_dir, acquisition_img_stem)
+            for acquisition_img_stem in acquisition_img_stems
+        ]
+    for acquisition_img_file in acquisition_img_files:
+        acquisition_channels_file = acquisition_img_file.with_name(
+            acquisition_img_file.name[:-9] + ".csv"
+        )
+        acquisition_channels: pd.DataFrame = pd.read_csv(acquisition_channels_file)
+        with _open_acquisition_img(acquisition_img_file) as acquisition_img:
+            assert len(acquisition_img.shape) == 3
+            assert len(acquisition_channels.index) == acquisition_img.shape[0]
+            yield acquisition_img_file.name[:-9], acquisition_channels, acquisition_img
+
+
+def _get_acquisition_img_file(
+    acquisition_dir: Union[str, PathLike], acquisition_img_stem: str
+) -> Path:
+    # acquisitions of HDF5 files are stored in the file itself
+    if Path(acquisition_dir).suffix == ".h5":
+        return Path(acquisition_dir)
+    return Path(acquisition_dir) / f"{acquisition_img_stem}.ome.tiff"
+
+
+@contextmanager
+def _open_acquisition_img(
+    acquisition_img_file: Path,
+) -> Iterator[Union[np.ndarray, _TiffPageStack]]:
+    # channels are read lazily: uncompressed, contiguous images (e.g. written by
+    # xtiff) are memory-mapped, all other images are read page by page
+    with tifffile.TiffFile(acquisition_img_file) as tiff:
+        acquisition_img: Union[np.ndarray, _TiffPageStack]
+        try:
+            acquisition_img = tifffile.memmap(acquisition_img_file, mode="r")
+        except ValueError:
+            acquisition_img = _TiffPageStack(tiff)
+        yield acquisition_img
+
+
+def _write_analysis_stacks(
+    acquisition_img: Union[
+        np.ndarray, _McdChannelStack, _TiffPageStack, _Hdf5ChannelStack
+    ],
+    acquisition_channel_names: Sequence[str],
+    acquisition_img_stem: str,
+    analysis_stacks: Sequence[AnalysisStack],
+    hpf: Optional[float] = None,
+    compression: Optional[str] = None,
+    predictor: bool = False,
+) -> None:
+    missing_channel_names = _get_missing_channel_names(
+        acquisition_channel_names, analysis_stacks
+    )
+    if len(missing_channel_names) > 0:
+        raise ValueError(
+            f"Channels missing in acquisition {acquisition_img_stem}: "
+            f"{missing_channel_names}"
+        )
+    channel_indices = _get_channel_indices(tuple(acquisition_channel_names))
+    # channels shared between stacks are read and filtered only once
+    analysis_channel_indices = list(
+        dict.fromkeys(
+            channel_indices[channel_name]
+            for analysis_stack in analysis_stacks
+            for channel_name in analysis_stack.analysis_channels
+        )
+    )
+    analysis_img_indices = {
+        channel_index: analysis_img_index
+        for analysis_img_index, channel_index in enumerate(analysis_channel_indices)
+    }
+    with _stage("channel_read", acquisition=acquisition_img_stem) as event:
+        analysis_img = acquisition_img[analysis_channel_indices]
+        event["bytes_read"] = analysis_img.nbytes
+    if hpf is not None:
+        with _stage("hpf", acquisition=acquisition_img_stem) as event:
+            # fancy indexing returns a copy, which can be filtered in place
+            filter_hot_pixels(analysis_img, hpf, in_place=True)
+            event["bytes_read"] = analysis_img.nbytes
+    for analysis_stack in analysis_stacks:
+        analysis_stack_img = analysis_img[
+            [
+                analysis_img_indices[channel_indices[channel_name]]
+                for channel_name in analysis_stack.analysis_channels
+            ]
+        ].astype(np.uint16)
+        analysis_img_file = Path(analysis_stack.analysis_dir) / (
+            acquisition_img_stem + ".tiff"
+        )
+        if analysis_stack.suffix is not None:
+            analysis_img_file = analysis_img_file.with_name(
+                analysis_img_file.name[:-5] + analysis_stack.suffix + ".tiff"
+            )
+        analysis_channels_file = analysis_img_file.with_suffix(".csv")
+        with _stage(
+            "stack_write",
+            acquisition=acquisition_img_stem,
+            output=analysis_img_file.name,
+        ) as event:
+            with atomic_file(analysis_img_file) as temp_analysis_img_file:
+                tifffile.imwrite(
+                    temp_analysis_img_file,
+                    data=analysis_stack_img,
+                    imagej=True,
+                    compression=compression,
+                    predictor=predictor,
+                )
+            with atomic_file(analysis_channels_file) as temp_analysis_channels_file:
+                with temp_analysis_channels_file.open("w") as f:
+                    f.write("\n".join(analysis_stack.analysis_channels))
+            _set_bytes_written(event, analysis_img_file, analysis_channels_file)
+        if analysis_stack.ilastik_preparation is not None:
+            # upscaled images and crops are created from the stack in memory,
+            # instead of reading the written stack again
+            Path(analysis_stack.ilastik_preparation.crops_dir).mkdir(exist_ok=True)
+            _write_ilastik_images(
+                analysis_stack_img,
+                analysis_img_file.name[:-5],
+                analysis_img_file.parent,
+                analysis_stack.ilastik_preparation,
+            )
+
+
+def _write_histocat_images(
+    acquisition_img: Union[
+        np.ndarray, _McdChannelStack, _TiffPageStack, _Hdf5ChannelStack
+    ],
+    acquisition_channels: pd.DataFrame,
+    histocat_img_dir: Path,
+    compression: Optional[str] = None,
+    predictor: bool = False,
+    threads: Optional[int] = None,
+) -> None:
+    with _stage("histocat_export", acquisition=histocat_img_dir.name) as event:
+        event["bytes_read"] = _write_histocat_channel_images(
+            acquisition_img,
+            acquisition_channels,
+            histocat_img_dir,
+            compression=compression,
+            predictor=predictor,
+            threads=threads,
+        )
+        _set_bytes_written(event, histocat_img_dir)
+
+
+def _write_histocat_channel_images(
+    acquisition_img: Union[
+        np.ndarray, _McdChannelStack, _TiffPageStack, _Hdf5ChannelStack
+    ],
+    acquisition_channels: pd.DataFrame,
+    histocat_img_dir: Path,
+    compression: Optional[str] = None,
+    predictor: bool = False,
+    threads: Optional[int] = None,
+) -> int:
+    assert len(acquisition_channels.index) == acquisition_img.shape[0]
+    histocat_img_dir.mkdir(exist_ok=True)
+    histocat_img_files = [
+        histocat_img_dir / histocat_img_name
+        for histocat_img_name in _get_histocat_img_names(acquisition_channels)
+    ]
+    bytes_read = 0
+    if threads is None or threads <= 1:
+        # images are read and written one channel at a time
+        for channel_index, histocat_img_file in enumerate(histocat_img_files):
+            acquisition_channel_img = np.asarray(acquisition_img[channel_index])
+            bytes_read += acquisition_channel_img.nbytes
+            _write_histocat_image(
+                acquisition_channel_img,
+                histocat_img_file,
+                compression=compression,
+                predictor=predictor,
+            )
+        return bytes_read
+    # channels are read in this thread and written by the thread pool, with a
+    # bounded number of channel images in flight
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        histocat_futures: Deque[Future[None]] = deque()
+        for channel_index, histocat_img_file in enumerate(histocat_img_files):
+            if len(histocat_futures) >= 2 * threads:
+                histocat_futures.popleft().result()
+            acquisition_channel_img = np.asarray(acquisition_img[channel_index])
+            bytes_read += acquisition_channel_img.nbytes
+            histocat_futures.append(
+                executor.submit(
+                    _write_histocat_image,
+                    acquisition_channel_img,
+                    histocat_img_file,
+                    compression=compression,
+                    predictor=predictor,
+                )
+            )
+        for histocat_future in histocat_futures:
+            histocat_future.result()
+    return bytes_read
+
+
+def _write_histocat_image(
+    histocat_img: np.ndarray,
+    histocat_img_file: Path,
+    compression: Optional[str] = None,
+    predictor: bool = False,
+) -> None:
+    with atomic_file(histocat_img_file) as temp_histocat_img_file:
+        tifffile.imwrite(
+            temp_histocat_img_file,
+            data=histocat_img,
+            imagej=True,
+            compression=compression,
+            predictor=predictor,
+        )
+
+
+def _scan_mcd_file(
+    mcd_file_handle: MCDFile,
+    txt_files: Sequence[Union[str, PathLike]],
+    dtype: Optional[str],
+) -> pd.DataFrame:
+    acquisitions = [
+        acquisition
+        for slide in mcd_file_handle.slides
+        for acquisition in slide.acquisitions
+    ]
+    txt_file_index = _index_txt_files(txt_files)
+    acquisition_origins = {}
+    acquisition_is_valids = {}
+    for acquisition in acquisitions:
+        acquisition_origins[acquisition.id] = "mcd"
+        acquisition_is_valids[acquisition.id] = _is_acquisition_data_valid(
+            mcd_file_handle, acquisition
+        )
+        if not acquisition_is_valids[acquisition.id]:
+            logging.warning(
+                f"Acquisition {acquisition.id} "
+                f"in file {mcd_file_handle.path.name} is corrupted"
+            )
+            # corrupted acquisitions are expected to be restored from their
+            # .txt file, if there is exactly one
+            if len(txt_file_index.get(str(acquisition.id), [])) == 1:
+                acquisition_origins[acquisition.id] = "txt"
+                acquisition_is_valids[acquisition.id] = True
+    acquisition_metadata = _create_acquisition_metadata(
+        mcd_file_handle, acquisition_origins, acquisition_is_valids
+    )
+    # uncompressed image data of the written .ome.tiff files
+    itemsize = np.dtype(dtype or np.float32).itemsize
+    return acquisition_metadata.assign(
+        num_channels=[acquisition.num_channels for acquisition in acquisitions],
+        channel_names=[acquisition.channel_names for acquisition in acquisitions],
+        channel_labels=[acquisition.channel_labels for acquisition in acquisitions],
+        ometiff_bytes=[
+            (
+                int(acquisition.metadata["MaxX"])
+                * int(acquisition.metadata["MaxY"])
+                * acquisition.num_channels
+                * itemsize
+                if acquisition_is_valids[acquisition.id]
+                else 0
+            )
+            for acquisition in acquisitions
+        ],
+    )
+
+
+def _is_acquisition_data_valid(
+    mcd_file_handle: MCDFile, acquisition: Acquisition
+) -> bool:
+    # same checks as done by MCDFile.read_acquisition, without reading any data
+    try:
+        data_start_offset = int(acquisition.metadata["DataStartOffset"])
+        data_end_offset = int(acquisition.metadata["DataEndOffset"])
+        value_bytes = int(acquisition.metadata["ValueBytes"])
+        int(acquisition.metadata["MaxX"])
+        int(acquisition.metadata["MaxY"])
+    except (KeyError, ValueError):
+        return False
+    if data_start_offset > data_end_offset or value_bytes <= 0:
+        return False
+    if data_end_offset > os.path.getsize(mcd_file_handle.path):
+        return False
+    bytes_per_pixel = (acquisition.num_channels + 3) * value_bytes
+    return (data_end_offset - data_start_offset) % bytes_per_pixel == 0
+
+
+def _open_zip_mcd_file(
+    zip_file_handle: ZipFile, mcd_member_name: str, mcd_file: Path
+) -> MCDFile:
+    # the MCD-XML is stored at the end of .mcd files, such that only the tail of
+    # the .mcd file is extracted into a sparse file of the original size; the
+    # tail is extended until it contains the (latest) MCD-XML
+    file_size = zip_file_handle.getinfo(mcd_member_name).file_size
+    tail_size = min(MCD_SCHEMA_TAIL_SIZE, file_size)
+    while True:
+        with zip_file_handle.open(mcd_member_name) as fsrc:
+            with mcd_file.open("wb") as fdst:
+                fdst.truncate(file_size)
+                fsrc.seek(file_size - tail_size)
+                fdst.seek(file_size - tail_size)
+                shutil.copyfileobj(fsrc, fdst)
+        f_mcd = MCDFile(mcd_file)
+        try:
+            f_mcd.open()
+            return f_mcd
+        except IOError:
+            f_mcd.close()
+            if tail_size == file_size:
+                raise
+            tail_size = min(2 * tail_size, file_size)
 
 
 def _create_acquisition_metadata(
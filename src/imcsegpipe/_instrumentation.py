@@ -0,0 +1,257 @@
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from os import PathLike
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Union
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore
+
+InstrumentationSink = Callable[[Dict[str, Any]], None]
+
+RSS_SAMPLING_INTERVAL = 0.01
+
+# sinks of the current process; worker processes receive a sink forwarding
+# their events to the parent process through their pool initializers
+_sinks: List[InstrumentationSink] = []
+# sinks are called from multiple threads (e.g. pipelined stages)
+_sinks_lock = threading.Lock()
+
+
+class JsonlSink:
+    def __init__(self, jsonl_file: Union[str, PathLike]) -> None:
+        self.jsonl_file = Path(jsonl_file)
+
+    def __call__(self, event: Dict[str, Any]) -> None:
+        # events are appended with a single write, such that events of
+        # concurrent processes are not interleaved
+        line = json.dumps(event) + "\n"
+        with self.jsonl_file.open("a") as f:
+            f.write(line)
+
+
+@contextmanager
+def instrument(*sinks: InstrumentationSink) -> Iterator[None]:
+    previous_sinks = list(_sinks)
+    _set_sinks(previous_sinks + list(sinks))
+    try:
+        yield
+    finally:
+        _set_sinks(previous_sinks)
+
+
+def read_instrumentation_events(jsonl_file: Union[str, PathLike]) -> pd.DataFrame:
+    with Path(jsonl_file).open("r") as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    return pd.DataFrame(data=events)
+
+
+def summarize_instrumentation_events(events: pd.DataFrame) -> pd.DataFrame:
+    events = events.assign(failed=events["status"] != "ok")
+    return events.groupby("stage", sort=False).agg(
+        count=("stage", "size"),
+        failures=("failed", "sum"),
+        time_s=("time_s", "sum"),
+        max_time_s=("time_s", "max"),
+        bytes_read=("bytes_read", "sum"),
+        bytes_written=("bytes_written", "sum"),
+        peak_rss_bytes=("peak_rss_bytes", "max"),
+    )
+
+
+class _QueueSink:
+    def __init__(self, queue: multiprocessing.Queue) -> None:
+        self._queue = queue
+
+    def __call__(self, event: Dict[str, Any]) -> None:
+        self._queue.put(event)
+
+
+def _set_sinks(sinks: Sequence[InstrumentationSink]) -> None:
+    _sinks[:] = sinks
+
+
+@contextmanager
+def _worker_sinks() -> Iterator[List[InstrumentationSink]]:
+    # events of worker processes are sent back through a queue and passed to
+    # the sinks of this process, such that sinks do not need to be picklable
+    # and receive the events of all processes; the pools using the returned
+    # sinks need to be shut down before leaving the context, such that all
+    # events have been sent
+    sinks = list(_sinks)
+    if all(isinstance(sink, _QueueSink) for sink in sinks):
+        # no sinks, or already in a worker process
+        yield sinks
+        return
+    queue: multiprocessing.Queue = multiprocessing.Queue()
+    forwarder = threading.Thread(
+        target=_forward_events, args=(queue, sinks), daemon=True
+    )
+    forwarder.start()
+    try:
+        yield [_QueueSink(queue)]
+    finally:
+        queue.put(None)
+        forwarder.join()
+        queue.close()
+        queue.join_thread()
+
+
+def _forward_events(
+    queue: multiprocessing.Queue, sinks: Sequence[InstrumentationSink]
+) -> None:
+    for event in iter(queue.get, None):
+        _emit_event(event, sinks)
+
+
+def _emit_event(event: Dict[str, Any], sinks: Sequence[InstrumentationSink]) -> None:
+    with _sinks_lock:
+        for sink in sinks:
+            try:
+                sink(event)
+            except Exception as e:
+                logging.warning(f"Error writing instrumentation event: {e}")
+
+
+@contextmanager
+def _stage(stage: str, **fields) -> Iterator[Dict[str, Any]]:
+    if len(_sinks) == 0:
+        yield {}
+        return
+    event: Dict[str, Any] = {
+        "stage": stage,
+        **fields,
+        "pid": os.getpid(),
+        "start_time": time.time(),
+        "bytes_read": 0,
+        "bytes_written": 0,
+    }
+    # the memory usage is sampled instead of resetting the peak memory usage of
+    # the process, which would affect concurrently running stages
+    rss_token = _rss_sampler.start()
+    start = time.perf_counter()
+    try:
+        yield event
+        event["status"] = "ok"
+    except Exception as e:
+        event["status"] = "error"
+        event["error"] = str(e)
+        raise
+    finally:
+        event["time_s"] = time.perf_counter() - start
+        event["peak_rss_bytes"] = _rss_sampler.stop(rss_token)
+        _emit_event(event, _sinks)
+
+
+class _RssSampler:
+    def __init__(self, interval: float) -> None:
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._peak_rss: Dict[object, Optional[int]] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> object:
+        # the sampling thread only runs while stages are running
+        token = object()
+        with self._lock:
+            self._peak_rss[token] = _get_rss()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return token
+
+    def stop(self, token: object) -> Optional[int]:
+        with self._lock:
+            self._sample()
+            return self._peak_rss.pop(token)
+
+    def reset(self) -> None:
+        self._lock = threading.Lock()
+        self._peak_rss = {}
+        self._thread = None
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if len(self._peak_rss) == 0:
+                    self._thread = None
+                    return
+                self._sample()
+            time.sleep(self._interval)
+
+    def _sample(self) -> None:
+        rss = _get_rss()
+        if rss is not None:
+            for token, peak_rss in self._peak_rss.items():
+                self._peak_rss[token] = max(rss, peak_rss or 0)
+
+
+_rss_sampler = _RssSampler(RSS_SAMPLING_INTERVAL)
+if hasattr(os, "register_at_fork"):
+    # the sampling thread is not inherited by forked worker processes
+    os.register_at_fork(after_in_child=_rss_sampler.reset)
+
+
+def _set_bytes_written(event: Dict[str, Any], *files: Union[str, PathLike]) -> None:
+    # the output files are only listed if the stage is instrumented, as listing
+    # output directories (e.g. histoCAT image folders) is not free
+    if event:
+        event["bytes_written"] = _get_total_file_size(*files)
+
+
+def _get_total_file_size(*files: Union[str, PathLike]) -> int:
+    # directories (e.g. histoCAT image folders) are summed up recursively
+    total_file_size = 0
+    for file in files:
+        if Path(file).is_dir():
+            total_file_size += sum(
+                f.stat().st_size for f in Path(file).rglob("*") if f.is_file()
+            )
+        elif Path(file).is_file():
+            total_file_size += Path(file).stat().st_size
+    return total_file_size
+
+
+def _get_rss() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    # the peak memory usage of the process on platforms without /proc
+    return _get_peak_rss()
+
+
+def _reset_peak_rss() -> None:
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _get_peak_rss() -> Optional[int]:
+    # unlike ru_maxrss, the high water mark is not inherited from the parent
+    # process on Linux and can be reset
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
@@ -0,0 +1,300 @@
+import os
+import sqlite3
+from os import PathLike
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+
+from ._imcsegpipe import _ACQUISITION_IMG_STEM_REGEX, _match_txt_file_stem
+
+INVENTORY_VERSION = 2
+
+INVENTORY_ROLES = {
+    "_mask.tiff": "mask",
+    ".ome.tiff": "ometiff",
+    ".mcd": "mcd",
+    ".txt": "txt",
+    ".zip": "zip",
+}
+
+_INVENTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    session TEXT,
+    acquisition TEXT,
+    acquisition_id INTEGER,
+    role TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir, role);
+CREATE INDEX IF NOT EXISTS files_session ON files (role, session);
+CREATE INDEX IF NOT EXISTS files_acquisition ON files (role, acquisition);
+"""
+
+_INVENTORY_COLUMNS = [
+    "path",
+    "size",
+    "mtime_ns",
+    "session",
+    "acquisition",
+    "acquisition_id",
+    "role",
+]
+
+
+class Inventory:
+    def __init__(self, inventory_file: Union[str, PathLike]) -> None:
+        self._inventory_file = Path(inventory_file)
+        self._connection = sqlite3.connect(str(self._inventory_file))
+        (inventory_version,) = self._connection.execute(
+            "PRAGMA user_version"
+        ).fetchone()
+        if inventory_version != INVENTORY_VERSION:
+            # inventories of other versions are rebuilt from scratch
+            with self._connection:
+                self._connection.executescript(
+                    "DROP TABLE IF EXISTS dirs; DROP TABLE IF EXISTS files;"
+                )
+                self._connection.execute(f"PRAGMA user_version = {INVENTORY_VERSION}")
+        with self._connection:
+            self._connection.executescript(_INVENTORY_SCHEMA)
+
+    def __enter__(self) -> "Inventory":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def update(self, *dirs: Union[str, PathLike], rescan: bool = False) -> None:
+        with self._connection:
+            for d in dirs:
+                root = os.path.abspath(d)
+                self._update_dir(root, rescan)
+                self._match_txt_files(root)
+
+    def get_files(
+        self,
+        root: Union[str, PathLike],
+        role: Optional[str] = None,
+        session: Optional[str] = None,
+        acquisition: Optional[str] = None,
+        recursive: bool = True,
+    ) -> List[Path]:
+        query, params = self._get_query(
+            "path, size, mtime_ns", root, role, session, acquisition
+        )
+        if not recursive:
+            query += " AND dir = ?"
+            params.append(os.path.abspath(root))
+        rows = self._connection.execute(query + " ORDER BY path", params).fetchall()
+        current_files = self._refresh_files(rows)
+        return [Path(path) for path, _, _ in rows if path in current_files]
+
+    def get_file_table(
+        self, root: Union[str, PathLike], role: Optional[str] = None
+    ) -> pd.DataFrame:
+        query, params = self._get_query(
+            ", ".join(_INVENTORY_COLUMNS), root, role, None, None
+        )
+        rows = self._connection.execute(query + " ORDER BY path", params).fetchall()
+        current_files = self._refresh_files([row[:3] for row in rows])
+        file_table = pd.DataFrame(
+            data=[
+                (path, *current_files[path], *row)
+                for path, _, _, *row in rows
+                if path in current_files
+            ],
+            columns=_INVENTORY_COLUMNS,
+        )
+        return file_table.astype({"acquisition_id": "Int64"})
+
+    def _refresh_files(
+        self, files: Sequence[Tuple[str, int, int]]
+    ) -> Dict[str, Tuple[int, int]]:
+        # files modified in place do not change the modification time of their
+        # directory, so the recorded size and modification time of the returned
+        # files are compared to their current ones
+        current_files = {}
+        stale_rows = []
+        removed_paths = []
+        for path, size, mtime_ns in files:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                removed_paths.append(path)
+                continue
+            if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+                stale_rows.append((stat.st_size, stat.st_mtime_ns, path))
+            current_files[path] = (stat.st_size, stat.st_mtime_ns)
+        if len(stale_rows) > 0 or len(removed_paths) > 0:
+            with self._connection:
+                self._connection.executemany(
+                    "UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?",
+                    stale_rows,
+                )
+                self._connection.executemany(
+                    "DELETE FROM files WHERE path = ?",
+                    [(path,) for path in removed_paths],
+                )
+        return current_files
+
+    def _get_query(
+        self,
+        columns: str,
+        root: Union[str, PathLike],
+        role: Optional[str],
+        session: Optional[str],
+        acquisition: Optional[str],
+    ) -> Tuple[str, List]:
+        query, params = self._get_root_query(columns, os.path.abspath(root))
+        for column, value in (
+            ("role", role),
+            ("session", session),
+            ("acquisition", acquisition),
+        ):
+            if value is not None:
+                query += f" AND {column} = ?"
+                params.append(value)
+        return query, params
+
+    def _get_root_query(self, columns: str, root: str) -> Tuple[str, List]:
+        # prefix comparison instead of LIKE, which would treat the underscores
+        # in file names as wildcards
+        root_prefix = os.path.join(root, "")
+        return (
+            f"SELECT {columns} FROM files WHERE (dir = ? OR substr(dir, 1, ?) = ?)",
+            [root, len(root_prefix), root_prefix],
+        )
+
+    def _update_dir(self, root: str, rescan: bool) -> None:
+        # directories are only listed if their modification time has changed,
+        # i.e. if files have been added, removed or renamed since the last scan;
+        # subdirectories of unchanged directories are looked up in the inventory
+        pending_dirs = [root]
+        while len(pending_dirs) > 0:
+            d = pending_dirs.pop()
+            try:
+                dir_mtime_ns = os.stat(d).st_mtime_ns
+            except FileNotFoundError:
+                self._remove_dir(d)
+                continue
+            row = self._connection.execute(
+                "SELECT mtime_ns FROM dirs WHERE path = ?", (d,)
+            ).fetchone()
+            if not rescan and row is not None and row[0] == dir_mtime_ns:
+                pending_dirs += [
+                    subdir
+                    for (subdir,) in self._connection.execute(
+                        "SELECT path FROM dirs WHERE parent = ?", (d,)
+                    )
+                ]
+                continue
+            file_rows = []
+            subdirs = set()
+            with os.scandir(d) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.add(entry.path)
+                    elif entry.is_file() and not entry.name.startswith("."):
+                        file_row = _get_file_row(entry)
+                        if file_row is not None:
+                            file_rows.append(file_row)
+            self._connection.execute("DELETE FROM files WHERE dir = ?", (d,))
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                file_rows,
+            )
+            for (subdir,) in self._connection.execute(
+                "SELECT path FROM dirs WHERE parent = ?", (d,)
+            ).fetchall():
+                if subdir not in subdirs:
+                    self._remove_dir(subdir)
+            self._connection.execute(
+                "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)",
+                (d, os.path.dirname(d), dir_mtime_ns),
+            )
+            pending_dirs += sorted(subdirs)
+
+    def _remove_dir(self, d: str) -> None:
+        d_prefix = os.path.join(d, "")
+        for table, column in (("files", "dir"), ("dirs", "path")):
+            self._connection.execute(
+                f"DELETE FROM {table} WHERE {column} = ? OR substr({column}, 1, ?) = ?",
+                (d, len(d_prefix), d_prefix),
+            )
+
+    def _match_txt_files(self, root: str) -> None:
+        # .txt files are matched to .mcd files in the same root directory, as
+        # done by match_txt_files, and stored as part of the .mcd file's session
+        query, params = self._get_root_query("session", root)
+        mcd_file_stems = {
+            session
+            for (session,) in self._connection.execute(
+                query + " AND role = 'mcd'", params
+            )
+        }
+        query, params = self._get_root_query("path, session", root)
+        txt_file_sessions: Dict[str, Optional[str]] = {}
+        for path, session in self._connection.execute(
+            query + " AND role = 'txt'", params
+        ).fetchall():
+            txt_file_session = _match_txt_file_stem(Path(path).stem, mcd_file_stems)
+            if txt_file_session != session:
+                txt_file_sessions[path] = txt_file_session
+        self._connection.executemany(
+            "UPDATE files SET session = ? WHERE path = ?",
+            [(session, path) for path, session in txt_file_sessions.items()],
+        )
+
+
+def _get_file_row(entry: os.DirEntry) -> Optional[Tuple]:
+    role = next(
+        (
+            role
+            for suffix, role in INVENTORY_ROLES.items()
+            if entry.name.endswith(suffix)
+        ),
+        None,
+    )
+    if role is None:
+        return None
+    session = None
+    acquisition = None
+    acquisition_id = None
+    if role in ("mcd", "zip"):
+        session = Path(entry.name).stem
+    elif role == "txt":
+        # the session of .txt files depends on the other files and is set
+        # after scanning the root directory
+        txt_file_stem = Path(entry.name).stem
+        if "_" in txt_file_stem and txt_file_stem.rsplit("_", 1)[1].isdigit():
+            acquisition_id = int(txt_file_stem.rsplit("_", 1)[1])
+    else:
+        m = _ACQUISITION_IMG_STEM_REGEX.match(entry.name)
+        if m is not None:
+            session = m.group("session")
+            acquisition = m.group("acquisition")
+            acquisition_id = int(m.group("acquisition_id"))
+    stat = entry.stat()
+    return (
+        entry.path,
+        os.path.dirname(entry.path),
+        stat.st_size,
+        stat.st_mtime_ns,
+        session,
+        acquisition,
+        acquisition_id,
+        role,
+    )
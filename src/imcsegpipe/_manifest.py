@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from os import PathLike
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Union
+
+MANIFEST_VERSION = 1
+
+
+@contextmanager
+def atomic_file(file: Union[str, PathLike]) -> Iterator[Path]:
+    # hidden temporary files are ignored when globbing for "[!.]*" files
+    temp_file = Path(file).with_name(f".{Path(file).name}")
+    try:
+        yield temp_file
+        os.replace(temp_file, file)
+    finally:
+        if temp_file.exists():
+            temp_file.unlink()
+
+
+def get_file_fingerprint(
+    file: Union[str, PathLike], checksum: bool = False
+) -> Dict[str, Any]:
+    # by default, files are fingerprinted by size and modification time only,
+    # as hashing would read the (raw) data in full once more
+    stat = Path(file).stat()
+    fingerprint: Dict[str, Any] = {"size": stat.st_size, "mtime": stat.st_mtime}
+    if checksum:
+        sha256 = hashlib.sha256()
+        with Path(file).open("rb") as f:
+            for chunk in iter(lambda: f.read(2**20), b""):
+                sha256.update(chunk)
+        fingerprint["sha256"] = sha256.hexdigest()
+    return fingerprint
+
+
+def get_file_fingerprints(
+    files: Sequence[Union[str, PathLike]], checksum: bool = False
+) -> Dict[str, Dict[str, Any]]:
+    return {
+        str(Path(file).absolute()): get_file_fingerprint(file, checksum=checksum)
+        for file in files
+    }
+
+
+class Manifest:
+    def __init__(self, manifest_file: Union[str, PathLike]) -> None:
+        self._manifest_file = Path(manifest_file)
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        if self._manifest_file.exists():
+            with self._manifest_file.open("r") as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION:
+                self._entries = manifest["entries"]
+
+    @property
+    def manifest_file(self) -> Path:
+        return self._manifest_file
+
+    def get_output_files(self, key: str) -> List[Path]:
+        return [Path(f) for f in self._entries[key]["outputs"]]
+
+    def get_result(self, key: str) -> Any:
+        return self._entries[key].get("result")
+
+    def is_up_to_date(
+        self,
+        key: str,
+        input_files: Sequence[Union[str, PathLike]],
+        params: Optional[Dict[str, Any]] = None,
+    ) -> bool:
+        entry = self._entries.get(key)
+        if entry is None or entry["params"] != _normalize_params(params):
+            return False
+        if entry.get("error") is not None:
+            return False
+        input_fingerprints: Dict[str, Dict[str, Any]] = entry["inputs"]
+        if set(input_fingerprints) != {str(Path(f).absolute()) for f in input_files}:
+            return False
+        for input_file, input_fingerprint in input_fingerprints.items():
+            if not Path(input_file).exists():
+                return False
+            stat = Path(input_file).stat()
+            if stat.st_size != input_fingerprint["size"]:
+                return False
+            # files whose modification time has changed are only compared by
+            # checksum if one has been recorded (e.g. by an earlier version)
+            if stat.st_mtime != input_fingerprint["mtime"]:
+                if "sha256" not in input_fingerprint:
+                    return False
+                input_file_fingerprint = get_file_fingerprint(input_file, checksum=True)
+                if input_file_fingerprint["sha256"] != input_fingerprint["sha256"]:
+                    return False
+                input_fingerprints[input_file] = input_file_fingerprint
+        return all(Path(output).exists() for output in entry["outputs"])
+
+    def update(
+        self,
+        key: str,
+        input_fingerprints: Dict[str, Dict[str, Any]],
+        output_files: Sequence[Union[str, PathLike]],
+        params: Optional[Dict[str, Any]] = None,
+        result: Any = None,
+    ) -> None:
+        self._entries[key] = {
+            "inputs": input_fingerprints,
+            "outputs": [str(Path(f).absolute()) for f in output_files],
+            "params": _normalize_params(params),
+            "result": result,
+        }
+
+    def update_error(self, key: str, error: str) -> None:
+        # failed outputs are never up to date
+        self._entries[key] = {
+            "inputs": {},
+            "outputs": [],
+            "params": None,
+            "result": None,
+            "error": error,
+        }
+
+    def save(self) -> None:
+        with atomic_file(self._manifest_file) as temp_manifest_file:
+            with temp_manifest_file.open("w") as f:
+                json.dump({"version": MANIFEST_VERSION, "entries": self._entries}, f)
+
+
+def _normalize_params(params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    # round-trip through JSON, such that e.g. tuples compare equal to lists
+    return json.loads(json.dumps(params or {}))
@@ -0,0 +1,362 @@
+import re
+from concurrent.futures import ProcessPoolExecutor
+from os import PathLike
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import tifffile
+from scipy import ndimage as ndi
+from scipy.spatial import cKDTree
+
+from ._manifest import atomic_file
+
+_ACQUISITION_STEM_PATTERN = re.compile(r"^.*_s[0-9]+_a[0-9]+_ac")
+
+
+def measure_objects(
+    img: np.ndarray,
+    mask: np.ndarray,
+    image_name: str = "FullStack",
+    neighbor_distance: Optional[float] = 8,
+    neighbor_method: str = "pixels",
+) -> pd.DataFrame:
+    if img.ndim == 2:
+        img = img[np.newaxis, :, :]
+    assert img.ndim == 3 and mask.ndim == 2 and img.shape[1:] == mask.shape
+    # foreground pixels are sorted by object, such that all objects and channels
+    # can be reduced at once using contiguous pixel ranges
+    pixel_indices = np.flatnonzero(mask)
+    pixel_labels = mask.ravel()[pixel_indices]
+    order = np.argsort(pixel_labels, kind="stable")
+    pixel_indices = pixel_indices[order]
+    object_numbers, object_starts, object_areas = np.unique(
+        pixel_labels[order], return_index=True, return_counts=True
+    )
+    columns: Dict[str, np.ndarray] = {"ObjectNumber": object_numbers}
+    size_shape_features = _measure_size_shape(
+        mask.shape, pixel_indices, object_starts, object_areas
+    )
+    for feature_name, feature_values in size_shape_features.items():
+        columns[f"AreaShape_{feature_name}"] = feature_values
+    columns["Location_Center_X"] = size_shape_features["Center_X"]
+    columns["Location_Center_Y"] = size_shape_features["Center_Y"]
+    # integer images are scaled to [0, 1], as done by CellProfiler
+    scale = 1.0
+    if np.issubdtype(img.dtype, np.integer):
+        scale = float(np.iinfo(img.dtype).max)
+    intensity_features = _measure_intensities(
+        img, pixel_indices, object_starts, object_areas
+    )
+    for feature_name, feature_values in intensity_features.items():
+        for channel_index in range(img.shape[0]):
+            columns[f"Intensity_{feature_name}_{image_name}_c{channel_index + 1}"] = (
+                feature_values[channel_index] / scale
+            )
+    if neighbor_distance is not None:
+        neighbors = measure_object_neighbors(
+            mask, neighbor_distance, method=neighbor_method
+        )
+        columns[f"Neighbors_NumberOfNeighbors_{neighbor_distance:g}"] = (
+            _count_neighbors(object_numbers, neighbors)
+        )
+    return pd.DataFrame(data=columns)
+
+
+def measure_object_neighbors(
+    mask: np.ndarray, distance: float, method: str = "pixels"
+) -> np.ndarray:
+    assert mask.ndim == 2
+    if method == "pixels":
+        return _measure_object_neighbors_by_pixels(mask, int(distance))
+    if method == "centroids":
+        return _measure_object_neighbors_by_centroids(mask, distance)
+    raise ValueError(f"Unsupported neighbor detection method: {method}")
+
+
+def write_object_neighbors(
+    neighbors: np.ndarray, neighbors_file: Union[str, PathLike]
+) -> None:
+    neighbors_df = pd.DataFrame(
+        data={
+            "first_object_number": neighbors[:, 0],
+            "second_object_number": neighbors[:, 1],
+        }
+    )
+    with atomic_file(neighbors_file) as temp_neighbors_file:
+        if Path(neighbors_file).suffix == ".parquet":
+            neighbors_df.to_parquet(temp_neighbors_file, index=False)
+        else:
+            neighbors_df.to_csv(temp_neighbors_file, index=False)
+
+
+def measure_cells(
+    images_dir: Union[str, PathLike],
+    masks_dir: Union[str, PathLike],
+    output_dir: Union[str, PathLike],
+    image_suffix: str = "_full.tiff",
+    mask_suffix: str = "_mask.tiff",
+    image_name: str = "FullStack",
+    neighbor_distance: Optional[float] = 8,
+    neighbor_method: str = "pixels",
+    neighbors_dir: Optional[Union[str, PathLike]] = None,
+    neighbors_format: str = "csv",
+    workers: Optional[int] = None,
+) -> pd.DataFrame:
+    img_files = sorted(Path(images_dir).glob(f"[!.]*{image_suffix}"))
+    mask_files: Dict[str, Path] = {}
+    for mask_file in sorted(Path(masks_dir).glob(f"[!.]*{mask_suffix}")):
+        m = _ACQUISITION_STEM_PATTERN.match(mask_file.name)
+        if m is not None:
+            mask_files.setdefault(m.group(0), mask_file)
+    if neighbors_dir is not None:
+        Path(neighbors_dir).mkdir(exist_ok=True)
+    job_args: List[Tuple[Path, Path, str, Optional[float], str, Optional[Path]]] = []
+    for img_file in img_files:
+        m = _ACQUISITION_STEM_PATTERN.match(img_file.name)
+        if m is not None and m.group(0) in mask_files:
+            neighbors_file = None
+            if neighbors_dir is not None and neighbor_distance is not None:
+                neighbors_file = (
+                    Path(neighbors_dir) / f"{m.group(0)}_neighbors.{neighbors_format}"
+                )
+            job_args.append(
+                (
+                    img_file,
+                    mask_files[m.group(0)],
+                    image_name,
+                    neighbor_distance,
+                    neighbor_method,
+                    neighbors_file,
+                )
+            )
+    if workers is not None and workers > 1 and len(job_args) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_measure_cells_job, *zip(*job_args)))
+    else:
+        results = [_measure_cells_job(*args) for args in job_args]
+    cell_tables = []
+    relationship_tables = []
+    for image_number, (objects, neighbors) in enumerate(results, start=1):
+        objects.insert(0, "ImageNumber", image_number)
+        cell_tables.append(objects)
+        if neighbors is not None:
+            # neighbor relationships are listed in both directions
+            first_object_numbers = np.concatenate((neighbors[:, 0], neighbors[:, 1]))
+            second_object_numbers = np.concatenate((neighbors[:, 1], neighbors[:, 0]))
+            relationship_tables.append(
+                pd.DataFrame(
+                    data={
+                        "Module": "MeasureObjectNeighbors",
+                        "Module Number": 6,
+                        "Relationship": "Neighbors",
+                        "First Object Name": "cell",
+                        "First Image Number": image_number,
+                        "First Object Number": first_object_numbers,
+                        "Second Object Name": "cell",
+                        "Second Image Number": image_number,
+                        "Second Object Number": second_object_numbers,
+                    }
+                ).sort_values(["First Object Number", "Second Object Number"])
+            )
+    cells = pd.DataFrame()
+    if len(cell_tables) > 0:
+        cells = pd.concat(cell_tables, ignore_index=True, copy=False)
+    Path(output_dir).mkdir(exist_ok=True)
+    with atomic_file(Path(output_dir) / "cell.csv") as temp_cell_file:
+        cells.to_csv(temp_cell_file, index=False)
+    if neighbor_distance is not None:
+        relationships_file = Path(output_dir) / "Object relationships.csv"
+        with atomic_file(relationships_file) as temp_relationships_file:
+            if len(relationship_tables) > 0:
+                pd.concat(relationship_tables, ignore_index=True, copy=False).to_csv(
+                    temp_relationships_file, index=False
+                )
+            else:
+                pd.DataFrame().to_csv(temp_relationships_file, index=False)
+    return cells
+
+
+def _measure_cells_job(
+    img_file: Path,
+    mask_file: Path,
+    image_name: str,
+    neighbor_distance: Optional[float],
+    neighbor_method: str,
+    neighbors_file: Optional[Path],
+) -> Tuple[pd.DataFrame, Optional[np.ndarray]]:
+    img = tifffile.imread(img_file)
+    mask = tifffile.imread(mask_file)
+    objects = measure_objects(img, mask, image_name=image_name, neighbor_distance=None)
+    neighbors = None
+    if neighbor_distance is not None:
+        neighbors = measure_object_neighbors(
+            mask, neighbor_distance, method=neighbor_method
+        )
+        if neighbors_file is not None:
+            write_object_neighbors(neighbors, neighbors_file)
+        objects[f"Neighbors_NumberOfNeighbors_{neighbor_distance:g}"] = (
+            _count_neighbors(objects["ObjectNumber"].to_numpy(), neighbors)
+        )
+    return objects, neighbors
+
+
+def _count_neighbors(object_numbers: np.ndarray, neighbors: np.ndarray) -> np.ndarray:
+    neighbor_counts = np.bincount(
+        neighbors.ravel(), minlength=int(object_numbers.max(initial=0)) + 1
+    )
+    return neighbor_counts[object_numbers]
+
+
+def _measure_intensities(
+    img: np.ndarray,
+    pixel_indices: np.ndarray,
+    object_starts: np.ndarray,
+    object_areas: np.ndarray,
+) -> Dict[str, np.ndarray]:
+    object_values = img.reshape((img.shape[0], -1))[:, pixel_indices]
+    integrated_intensities = np.add.reduceat(
+        object_values, object_starts, axis=1, dtype=np.float64
+    )
+    mean_intensities = integrated_intensities / object_areas
+    # the variance is computed channel by channel to limit memory usage
+    std_intensities = np.empty_like(mean_intensities)
+    for channel_index, channel_values in enumerate(object_values):
+        channel_values = channel_values.astype(np.float64)
+        channel_deviations = channel_values - np.repeat(
+            mean_intensities[channel_index], object_areas
+        )
+        std_intensities[channel_index] = np.sqrt(
+            np.add.reduceat(channel_deviations**2, object_starts) / object_areas
+        )
+    return {
+        "IntegratedIntensity": integrated_intensities,
+        "MeanIntensity": mean_intensities,
+        "StdIntensity": std_intensities,
+        "MinIntensity": np.minimum.reduceat(object_values, object_starts, axis=1),
+        "MaxIntensity": np.maximum.reduceat(object_values, object_starts, axis=1),
+    }
+
+
+def _measure_size_shape(
+    shape: Tuple[int, ...],
+    pixel_indices: np.ndarray,
+    object_starts: np.ndarray,
+    object_areas: np.ndarray,
+) -> Dict[str, np.ndarray]:
+    ys, xs = np.unravel_index(pixel_indices, shape)
+    center_xs = np.add.reduceat(xs, object_starts, dtype=np.float64) / object_areas
+    center_ys = np.add.reduceat(ys, object_starts, dtype=np.float64) / object_areas
+    dxs = xs - np.repeat(center_xs, object_areas)
+    dys = ys - np.repeat(center_ys, object_areas)
+    # axis lengths and eccentricity are derived from the second central moments
+    # of each object, as done by skimage.measure.regionprops
+    mu_xx = np.add.reduceat(dxs * dxs, object_starts) / object_areas
+    mu_yy = np.add.reduceat(dys * dys, object_starts) / object_areas
+    mu_xy = np.add.reduceat(dxs * dys, object_starts) / object_areas
+    common = np.sqrt((mu_xx - mu_yy) ** 2 + 4 * mu_xy**2)
+    major_eigenvalues = (mu_xx + mu_yy + common) / 2
+    minor_eigenvalues = np.maximum((mu_xx + mu_yy - common) / 2, 0)
+    min_xs = np.minimum.reduceat(xs, object_starts)
+    max_xs = np.maximum.reduceat(xs, object_starts) + 1
+    min_ys = np.minimum.reduceat(ys, object_starts)
+    max_ys = np.maximum.reduceat(ys, object_starts) + 1
+    bounding_box_areas = (max_xs - min_xs) * (max_ys - min_ys)
+    return {
+        "Area": object_areas,
+        "Center_X": center_xs,
+        "Center_Y": center_ys,
+        "BoundingBoxMinimum_X": min_xs,
+        "BoundingBoxMaximum_X": max_xs,
+        "BoundingBoxMinimum_Y": min_ys,
+        "BoundingBoxMaximum_Y": max_ys,
+        "BoundingBoxArea": bounding_box_areas,
+        "Extent": object_areas / bounding_box_areas,
+        "MajorAxisLength": 4 * np.sqrt(major_eigenvalues),
+        "MinorAxisLength": 4 * np.sqrt(minor_eigenvalues),
+        "Eccentricity": np.sqrt(
+            1
+            - np.divide(
+                minor_eigenvalues,
+                major_eigenvalues,
+                out=np.ones_like(major_eigenvalues),
+                where=major_eigenvalues > 0,
+            )
+        ),
+    }
+
+
+def _measure_object_neighbors_by_pixels(mask: np.ndarray, distance: int) -> np.ndarray:
+    # objects are neighbors if any two of their pixels are within the specified
+    # (Euclidean) distance, which is equivalent to CellProfiler's expansion of
+    # objects by a disk-shaped structuring element
+    labels = mask.astype(np.int64, copy=False)
+    num_labels = int(labels.max(initial=0)) + 1
+    height, width = labels.shape
+    foreground = labels > 0
+    # the closest pixels of two objects are boundary pixels facing each other:
+    # for offsets pointing downwards (rightwards), the first pixel's neighbor
+    # below (to the right) and the second pixel's neighbor above (to the left)
+    # belong to another object, so that only these pixels need to be scanned
+    down_boundary = foreground.copy()
+    down_boundary[:-1] &= labels[:-1] != labels[1:]
+    up_boundary = foreground.copy()
+    up_boundary[1:] &= labels[1:] != labels[:-1]
+    right_boundary = foreground.copy()
+    right_boundary[:, :-1] &= labels[:, :-1] != labels[:, 1:]
+    left_boundary = foreground.copy()
+    left_boundary[:, 1:] &= labels[:, 1:] != labels[:, :-1]
+    down_offsets = [
+        (dy, dx)
+        for dy in range(1, distance + 1)
+        for dx in range(-distance, distance + 1)
+        if dy * dy + dx * dx <= distance * distance
+    ]
+    right_offsets = [(0, dx) for dx in range(1, distance + 1)]
+    padded_width = width + 2 * distance
+    pair_keys = [np.empty(0, dtype=np.int64)]
+    for first_boundary, second_boundary, offsets in (
+        (down_boundary, up_boundary, down_offsets),
+        (right_boundary, left_boundary, right_offsets),
+    ):
+        ys, xs = np.nonzero(first_boundary)
+        first_labels = labels[ys, xs]
+        first_indices = (ys + distance) * padded_width + xs + distance
+        second_boundary_labels = np.pad(
+            np.where(second_boundary, labels, 0), distance
+        ).ravel()
+        for dy, dx in offsets:
+            second_labels = second_boundary_labels[
+                first_indices + dy * padded_width + dx
+            ]
+            is_pair = (second_labels != first_labels) & (second_labels > 0)
+            first_pair_labels = first_labels[is_pair]
+            second_pair_labels = second_labels[is_pair]
+            # hash-based deduplication is faster than sorting for large arrays
+            pair_keys.append(
+                pd.unique(
+                    np.minimum(first_pair_labels, second_pair_labels) * num_labels
+                    + np.maximum(first_pair_labels, second_pair_labels)
+                )
+            )
+    unique_pair_keys = np.unique(np.concatenate(pair_keys))
+    return np.stack(
+        (unique_pair_keys // num_labels, unique_pair_keys % num_labels), axis=1
+    )
+
+
+def _measure_object_neighbors_by_centroids(
+    mask: np.ndarray, distance: float
+) -> np.ndarray:
+    object_numbers = np.flatnonzero(np.bincount(mask.ravel()))
+    object_numbers = object_numbers[object_numbers > 0]
+    if len(object_numbers) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    centroids = np.stack(
+        ndi.center_of_mass(np.ones(mask.shape), labels=mask, index=object_numbers)
+    )
+    pairs = cKDTree(centroids).query_pairs(distance, output_type="ndarray")
+    neighbors = object_numbers[pairs].astype(np.int64)
+    neighbors.sort(axis=1)
+    return neighbors[np.lexsort((neighbors[:, 1], neighbors[:, 0]))]
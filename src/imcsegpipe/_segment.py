@@ -0,0 +1,285 @@
+from concurrent.futures import ProcessPoolExecutor
+from os import PathLike
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+import numpy as np
+import tifffile
+from scipy import ndimage as ndi
+
+from ._manifest import atomic_file
+
+
+def segment_probabilities(
+    probabilities_dir: Union[str, PathLike],
+    masks_dir: Union[str, PathLike],
+    downscaled_probabilities_dir: Optional[Union[str, PathLike]] = None,
+    probabilities_suffix: str = "_Probabilities.tiff",
+    scale: int = 2,
+    workers: Optional[int] = None,
+    **segment_cells_kwargs,
+) -> None:
+    Path(masks_dir).mkdir(exist_ok=True)
+    if downscaled_probabilities_dir is not None:
+        Path(downscaled_probabilities_dir).mkdir(exist_ok=True)
+    probabilities_files = sorted(
+        Path(probabilities_dir).glob(f"[!.]*{probabilities_suffix}")
+    )
+    job_args = [
+        (
+            probabilities_file,
+            Path(masks_dir),
+            (
+                Path(downscaled_probabilities_dir)
+                if downscaled_probabilities_dir is not None
+                else None
+            ),
+            scale,
+            segment_cells_kwargs,
+        )
+        for probabilities_file in probabilities_files
+    ]
+    if workers is not None and workers > 1 and len(job_args) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_segment_probabilities_job, *zip(*job_args)))
+    else:
+        for args in job_args:
+            _segment_probabilities_job(*args)
+
+
+def segment_cells(
+    probabilities_img: np.ndarray,
+    nuclei_smoothing_diameter: float = 2.0,
+    nuclei_diameter_range: Tuple[float, float] = (3.0, 12.0),
+    nuclei_threshold_correction: float = 1.2,
+    min_nucleus_area: int = 4,
+    cells_threshold_smoothing_scale: float = 1.3488,
+    cells_threshold_correction: float = 1.0,
+) -> np.ndarray:
+    assert probabilities_img.ndim == 3 and probabilities_img.shape[2] >= 2
+    nuclei_img = probabilities_img[:, :, 0]
+    cells_img = np.clip(probabilities_img[:, :, 0] + probabilities_img[:, :, 1], 0, 1)
+    if nuclei_smoothing_diameter > 0:
+        nuclei_img = np.clip(
+            _smooth_img(nuclei_img, nuclei_smoothing_diameter / 2.35), 0, 1
+        )
+    nuclei_mask = _identify_nuclei(
+        nuclei_img, nuclei_diameter_range, nuclei_threshold_correction
+    )
+    nuclei_mask = _filter_objects(nuclei_mask, min_nucleus_area)
+    return _identify_cells(
+        cells_img,
+        nuclei_mask,
+        cells_threshold_smoothing_scale,
+        cells_threshold_correction,
+    )
+
+
+def _segment_probabilities_job(
+    probabilities_file: Path,
+    masks_dir: Path,
+    downscaled_probabilities_dir: Optional[Path],
+    scale: int,
+    segment_cells_kwargs: dict,
+) -> None:
+    probabilities_img = tifffile.imread(probabilities_file)
+    if probabilities_img.shape[0] == 3 and probabilities_img.shape[-1] != 3:
+        # channels last, as exported by ilastik
+        probabilities_img = np.moveaxis(probabilities_img, 0, -1)
+    # integer images are scaled to [0, 1], as done by CellProfiler
+    max_value = 1.0
+    if np.issubdtype(probabilities_img.dtype, np.integer):
+        max_value = float(np.iinfo(probabilities_img.dtype).max)
+    probabilities_img = _downscale_img(probabilities_img, scale) / max_value
+    mask = segment_cells(probabilities_img, **segment_cells_kwargs)
+    probabilities_img_stem = probabilities_file.name[: -len(".tiff")]
+    mask_file = masks_dir / f"{probabilities_img_stem}_mask.tiff"
+    with atomic_file(mask_file) as temp_mask_file:
+        tifffile.imwrite(temp_mask_file, data=mask.astype(np.uint16))
+    if downscaled_probabilities_dir is not None:
+        downscaled_probabilities_file = (
+            downscaled_probabilities_dir / f"{probabilities_img_stem}_s1.tiff"
+        )
+        with atomic_file(
+            downscaled_probabilities_file
+        ) as temp_downscaled_probabilities_file:
+            tifffile.imwrite(
+                temp_downscaled_probabilities_file,
+                data=np.rint(probabilities_img * 65535).astype(np.uint16),
+                photometric="rgb",
+                compression="zlib",
+            )
+
+
+def _downscale_img(img: np.ndarray, scale: int) -> np.ndarray:
+    # bilinear downscaling by an integer factor without anti-aliasing, as done by
+    # CellProfiler's Resize module, reduces to the mean of 2x2 pixel blocks;
+    # for other factors, the block mean is used as well
+    height = img.shape[0] // scale
+    width = img.shape[1] // scale
+    img = img[: height * scale, : width * scale]
+    blocks = img.reshape((height, scale, width, scale) + img.shape[2:])
+    return blocks.mean(axis=(1, 3), dtype=np.float64)
+
+
+def _smooth_img(img: np.ndarray, sigma: float) -> np.ndarray:
+    # intensities are normalized by the filter weights inside the image, such
+    # that image borders are not darkened
+    smoothed_img = ndi.gaussian_filter(img, sigma, mode="constant", cval=0)
+    weights_img = ndi.gaussian_filter(np.ones_like(img), sigma, mode="constant", cval=0)
+    return smoothed_img / weights_img
+
+
+def _threshold_li(img: np.ndarray) -> float:
+    # minimum cross-entropy thresholding (Li & Lee, 1993), as implemented by
+    # skimage.filters.threshold_li
+    values = img.ravel().astype(np.float64)
+    values = values[np.isfinite(values)]
+    unique_values = np.unique(values)
+    if len(unique_values) < 2:
+        return float(unique_values[0]) if len(unique_values) > 0 else 0.0
+    tolerance = np.min(np.diff(unique_values)) / 2
+    min_value = unique_values[0]
+    values = values - min_value
+    threshold = np.mean(values)
+    previous_threshold = -2 * tolerance
+    while abs(threshold - previous_threshold) > tolerance:
+        previous_threshold = threshold
+        foreground = values > threshold
+        mean_foreground = np.mean(values[foreground])
+        mean_background = np.mean(values[~foreground])
+        if mean_background == 0:
+            break
+        threshold = (mean_background - mean_foreground) / (
+            np.log(mean_background) - np.log(mean_foreground)
+        )
+    return float(threshold + min_value)
+
+
+def _threshold_img(img: np.ndarray, threshold_correction: float) -> np.ndarray:
+    # constant images (e.g. all-zero probabilities) have no foreground, instead
+    # of a single object covering the whole image
+    if img.size == 0 or np.min(img) == np.max(img):
+        return np.zeros(img.shape, dtype=bool)
+    threshold = np.clip(_threshold_li(img) * threshold_correction, 0, 1)
+    return img >= threshold
+
+
+def _identify_nuclei(
+    img: np.ndarray,
+    diameter_range: Tuple[float, float],
+    threshold_correction: float,
+) -> np.ndarray:
+    min_diameter, max_diameter = diameter_range
+    binary_img = _threshold_img(img, threshold_correction)
+    # holes smaller than the maximum object area are filled before and after
+    # declumping
+    max_hole_area = max_diameter**2
+    labels, _ = ndi.label(binary_img, structure=np.ones((3, 3)))
+    binary_img = _fill_labeled_holes(labels, max_hole_area) > 0
+    # clumped objects are split by shape, i.e. seeded at the maxima of the
+    # distance transform, which is randomized slightly to get unique maxima
+    distance_img = ndi.distance_transform_edt(binary_img)
+    distance_img += np.random.RandomState(0).uniform(0, 0.001, distance_img.shape)
+    maxima_suppression_radius = max(1.0, min_diameter / 1.5 - 0.5)
+    maxima_img = binary_img & (
+        distance_img
+        == ndi.maximum_filter(distance_img, footprint=_disk(maxima_suppression_radius))
+    )
+    markers, _ = ndi.label(maxima_img, structure=np.ones((3, 3)))
+    # dividing lines are drawn along the intensity valleys between seeds
+    labels = _watershed(1 - img, markers, binary_img)
+    return _fill_labeled_holes(labels, max_hole_area)
+
+
+def _identify_cells(
+    img: np.ndarray,
+    nuclei_mask: np.ndarray,
+    threshold_smoothing_scale: float,
+    threshold_correction: float,
+) -> np.ndarray:
+    threshold_img = img
+    if threshold_smoothing_scale > 0:
+        # the threshold smoothing scale is converted to a Gaussian sigma, as
+        # done by CellProfiler
+        threshold_img = _smooth_img(img, threshold_smoothing_scale / 0.6744 / 2.0)
+    binary_img = _threshold_img(threshold_img, threshold_correction) | (nuclei_mask > 0)
+    # foreground regions without nuclei cannot be reached from any nucleus
+    foreground_labels, _ = ndi.label(binary_img, structure=np.ones((3, 3)))
+    binary_img &= np.isin(
+        foreground_labels, np.unique(foreground_labels[nuclei_mask > 0])
+    )
+    labels = _watershed(1 - img, nuclei_mask, binary_img)
+    return _fill_labeled_holes(labels)
+
+
+def _filter_objects(labels: np.ndarray, min_area: int) -> np.ndarray:
+    areas = np.bincount(labels.ravel())
+    keep = areas >= min_area
+    keep[0] = False
+    # remaining objects are numbered consecutively
+    new_labels = np.zeros(len(areas), dtype=labels.dtype)
+    new_labels[keep] = np.arange(1, np.count_nonzero(keep) + 1)
+    return new_labels[labels]
+
+
+def _watershed(img: np.ndarray, markers: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    # scipy's image foresting transform requires integer images; pixels outside
+    # of the mask are flooded last and removed afterwards
+    cost_img = np.full(img.shape, np.iinfo(np.uint16).max, dtype=np.uint16)
+    if np.any(mask):
+        masked_img = img[mask] - np.min(img[mask])
+        max_value = np.max(masked_img)
+        if max_value > 0:
+            masked_img *= (np.iinfo(np.uint16).max - 1) / max_value
+        cost_img[mask] = np.rint(masked_img)
+    labels = ndi.watershed_ift(
+        cost_img, markers.astype(np.int32), structure=np.ones((3, 3))
+    )
+    labels[~mask] = 0
+    return labels
+
+
+def _fill_labeled_holes(
+    labels: np.ndarray, max_area: Optional[float] = None
+) -> np.ndarray:
+    # holes are background regions not touching the image border, whose
+    # neighboring pixels all belong to the same object
+    background_labels, num_background_labels = ndi.label(labels == 0)
+    if num_background_labels == 0:
+        return labels
+    index = np.arange(1, num_background_labels + 1)
+    max_neighbor_labels = ndi.maximum(
+        ndi.grey_dilation(labels, size=(3, 3)), background_labels, index
+    )
+    min_neighbor_labels = ndi.minimum(
+        ndi.grey_erosion(
+            np.where(labels == 0, np.iinfo(labels.dtype).max, labels), size=(3, 3)
+        ),
+        background_labels,
+        index,
+    )
+    is_hole = (max_neighbor_labels > 0) & (max_neighbor_labels == min_neighbor_labels)
+    border_background_labels = np.unique(
+        np.concatenate(
+            (
+                background_labels[0],
+                background_labels[-1],
+                background_labels[:, 0],
+                background_labels[:, -1],
+            )
+        )
+    )
+    border_background_labels = border_background_labels[border_background_labels > 0]
+    is_hole[border_background_labels - 1] = False
+    if max_area is not None:
+        is_hole &= np.bincount(background_labels.ravel())[1:] < max_area
+    hole_labels = np.zeros(num_background_labels + 1, dtype=labels.dtype)
+    hole_labels[1:][is_hole] = max_neighbor_labels[is_hole]
+    return labels + hole_labels[background_labels]
+
+
+def _disk(radius: float) -> np.ndarray:
+    r = int(radius)
+    y, x = np.mgrid[-r : r + 1, -r : r + 1]
+    return x**2 + y**2 <= radius**2
@@ -0,0 +1,697 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from io import StringIO
+from os import PathLike
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import pandas as pd
+from readimc import MCDFile
+
+from ._imcsegpipe import (
+    _check_analysis_channels,
+    _check_compression,
+    _get_mcd_file_channel_names,
+    create_multiple_analysis_stacks,
+    export_to_histocat,
+    extract_mcd_file,
+    extract_zip_mcd_files,
+    match_txt_files,
+    scan_mcd_file,
+    scan_zip_mcd_files,
+)
+from ._instrumentation import _set_sinks, _worker_sinks
+from ._inventory import Inventory
+from ._manifest import Manifest, get_file_fingerprints
+from .utils import AnalysisStack, IlastikPreparation
+
+
+class _Session(NamedTuple):
+    zip_file: Optional[Path]
+    mcd_files: List[Path]
+    txt_files: List[Path]
+
+    @property
+    def key(self) -> str:
+        session_file = self.zip_file or self.mcd_files[0]
+        return f"extract_session:{session_file.absolute()}"
+
+    @property
+    def input_files(self) -> List[Path]:
+        if self.zip_file is not None:
+            return [self.zip_file]
+        return self.mcd_files + self.txt_files
+
+
+class _Task(NamedTuple):
+    key: str
+    fun: Callable
+    args: Tuple
+    kwargs: Dict[str, Any]
+    input_files: List[Path]
+    output_files: List[Path]
+    params: Dict[str, Any]
+
+
+def process_sessions(
+    raw_dirs: Sequence[Union[str, PathLike]],
+    work_dir: Union[str, PathLike],
+    file_regex: str = "*.zip",
+    full_channels: Optional[Sequence[str]] = None,
+    ilastik_channels: Optional[Sequence[str]] = None,
+    hpf: Optional[float] = 50.0,
+    export_histocat: bool = True,
+    workers: Optional[int] = None,
+    max_sessions: Optional[int] = None,
+    temp_dir: Optional[Union[str, PathLike]] = None,
+    incremental: bool = True,
+    fused: bool = False,
+    tile_size: Optional[int] = None,
+    compression: Optional[str] = None,
+    predictor: bool = False,
+    dtype: Optional[str] = None,
+    embed_schema: bool = True,
+    overview_images: Optional[str] = "png",
+    thumbnail_size: int = 1024,
+    defer_overview_images: bool = False,
+    prepare_ilastik: bool = False,
+    inventory_file: Optional[Union[str, PathLike]] = None,
+    txt_cache_dir: Optional[Union[str, PathLike]] = None,
+    txt_workers: Optional[int] = None,
+    pipeline_depth: Optional[int] = None,
+    raise_errors: bool = False,
+) -> pd.DataFrame:
+    _check_compression(compression, predictor=predictor, dtype=dtype)
+    acquisitions_dir = Path(work_dir) / "ometiff"
+    ilastik_dir = Path(work_dir) / "ilastik"
+    histocat_dir = Path(work_dir) / "histocat"
+    final_images_dir = Path(work_dir) / "cpout" / "images"
+    for d in (acquisitions_dir, ilastik_dir, histocat_dir, final_images_dir):
+        d.mkdir(parents=True, exist_ok=True)
+    analysis_stacks = []
+    if full_channels is not None:
+        analysis_stacks.append(
+            AnalysisStack(final_images_dir, full_channels, suffix="_full")
+        )
+    if ilastik_channels is not None:
+        analysis_stacks.append(
+            AnalysisStack(
+                ilastik_dir,
+                ilastik_channels,
+                suffix="_ilastik",
+                ilastik_preparation=(
+                    IlastikPreparation(Path(work_dir) / "crops")
+                    if prepare_ilastik
+                    else None
+                ),
+            )
+        )
+    # with an inventory, the raw and output directories are crawled once and
+    # only rescanned where their contents have changed since the last run
+    inventory = None
+    if inventory_file is not None:
+        inventory = Inventory(inventory_file)
+        inventory.update(*raw_dirs, acquisitions_dir)
+    sessions = _find_sessions(raw_dirs, file_regex, inventory=inventory)
+    if len(analysis_stacks) > 0:
+        _check_session_channels(sessions, analysis_stacks)
+    session_params = {
+        "tile_size": tile_size,
+        "compression": compression,
+        "predictor": predictor,
+        "dtype": dtype,
+        "embed_schema": embed_schema,
+        "overview_images": overview_images,
+        "thumbnail_size": thumbnail_size,
+    }
+    if max_sessions is None or max_sessions < 1:
+        max_sessions = workers or 1
+    # outputs that are up to date according to the manifest are skipped, unless
+    # incremental processing is disabled
+    manifest = Manifest(Path(work_dir) / "manifest.json")
+    session_acquisition_metadatas: Dict[int, pd.DataFrame] = {}
+    pending_tasks: List[_Task] = []
+    # failed sessions and tasks are reported and recorded in the manifest,
+    # while the remaining sessions are processed
+    errors: Dict[str, str] = {}
+    try:
+        with _worker_sinks() as worker_sinks, ProcessPoolExecutor(
+            max_workers=workers, initializer=_set_sinks, initargs=(worker_sinks,)
+        ) as executor:
+            session_futures: Dict[Future, int] = {}
+            task_futures: Dict[Future, _Task] = {}
+            next_session_index = 0
+            while (
+                next_session_index < len(sessions)
+                or len(pending_tasks) > 0
+                or len(session_futures) > 0
+                or len(task_futures) > 0
+            ):
+                # limit the number of sessions in flight, and thereby the number
+                # of temporary directories holding extracted .zip archives
+                while (
+                    next_session_index < len(sessions)
+                    and len(session_futures) < max_sessions
+                ):
+                    session = sessions[next_session_index]
+                    if incremental and manifest.is_up_to_date(
+                        session.key, session.input_files, params=session_params
+                    ):
+                        session_acquisition_metadatas[next_session_index] = (
+                            _read_acquisition_metadata(manifest.get_result(session.key))
+                        )
+                        for acquisition_dir in manifest.get_output_files(session.key):
+                            pending_tasks += _get_acquisition_dir_tasks(
+                                acquisition_dir,
+                                histocat_dir if export_histocat else None,
+                                analysis_stacks,
+                                hpf,
+                                compression=compression,
+                                predictor=predictor,
+                                inventory=inventory,
+                            )
+                    else:
+                        session_future = executor.submit(
+                            _extract_session,
+                            session,
+                            acquisitions_dir,
+                            temp_dir=temp_dir,
+                            analysis_stacks=analysis_stacks if fused else None,
+                            hpf=hpf,
+                            histocat_dir=(
+                                histocat_dir if fused and export_histocat else None
+                            ),
+                            tile_size=tile_size,
+                            compression=compression,
+                            predictor=predictor,
+                            dtype=dtype,
+                            embed_schema=embed_schema,
+                            overview_images=overview_images,
+                            thumbnail_size=thumbnail_size,
+                            defer_overview_images=defer_overview_images,
+                            txt_cache_dir=txt_cache_dir,
+                            txt_workers=txt_workers,
+                            pipeline_depth=pipeline_depth,
+                        )
+                        session_futures[session_future] = next_session_index
+                    next_session_index += 1
+                for task in pending_tasks:
+                    if not incremental or not manifest.is_up_to_date(
+                        task.key, task.input_files, params=task.params
+                    ):
+                        task_future = executor.submit(
+                            _run_task,
+                            task.fun,
+                            task.args,
+                            task.kwargs,
+                            task.input_files,
+                        )
+                        task_futures[task_future] = task
+                pending_tasks.clear()
+                if len(session_futures) == 0 and len(task_futures) == 0:
+                    continue
+                done, _ = wait(
+                    set(session_futures) | set(task_futures),
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    if future in task_futures:
+                        task = task_futures.pop(future)
+                        try:
+                            task_input_fingerprints = future.result()
+                        except Exception as e:
+                            logging.error(f"Error running task {task.key}: {e}")
+                            errors[task.key] = str(e)
+                            manifest.update_error(task.key, str(e))
+                            continue
+                        manifest.update(
+                            task.key,
+                            task_input_fingerprints,
+                            task.output_files,
+                            params=task.params,
+                        )
+                        continue
+                    session_index = session_futures.pop(future)
+                    session = sessions[session_index]
+                    try:
+                        (
+                            acquisition_metadata,
+                            acquisition_dirs,
+                            input_fingerprints,
+                            acquisition_dir_fingerprints,
+                        ) = future.result()
+                    except Exception as e:
+                        session_file = session.zip_file or session.mcd_files[0]
+                        logging.error(
+                            f"Error processing session {session_file.name}: {e}"
+                        )
+                        errors[session.key] = str(e)
+                        manifest.update_error(session.key, str(e))
+                        manifest.save()
+                        continue
+                    session_acquisition_metadatas[session_index] = acquisition_metadata
+                    manifest.update(
+                        session.key,
+                        input_fingerprints,
+                        acquisition_dirs,
+                        params=session_params,
+                        result=_write_acquisition_metadata(acquisition_metadata),
+                    )
+                    manifest.save()
+                    for acquisition_dir in acquisition_dirs:
+                        acquisition_dir_tasks = _get_acquisition_dir_tasks(
+                            acquisition_dir,
+                            histocat_dir if export_histocat else None,
+                            analysis_stacks,
+                            hpf,
+                            compression=compression,
+                            predictor=predictor,
+                        )
+                        if not fused:
+                            pending_tasks += acquisition_dir_tasks
+                            continue
+                        # in fused mode, stacks and histoCAT images have already
+                        # been written while extracting the session
+                        for task in acquisition_dir_tasks:
+                            manifest.update(
+                                task.key,
+                                acquisition_dir_fingerprints[str(acquisition_dir)],
+                                task.output_files,
+                                params=task.params,
+                            )
+    finally:
+        manifest.save()
+        if inventory is not None:
+            inventory.close()
+    if raise_errors and len(errors) > 0:
+        raise RuntimeError(
+            f"Processing failed for {len(errors)} sessions/tasks: {sorted(errors)}"
+        )
+    acquisition_metadatas = [
+        session_acquisition_metadatas[session_index]
+        for session_index in sorted(session_acquisition_metadatas)
+        if len(session_acquisition_metadatas[session_index].index) > 0
+    ]
+    acquisition_metadata = pd.DataFrame()
+    if len(acquisition_metadatas) > 0:
+        acquisition_metadata = pd.concat(acquisition_metadatas, copy=False)
+    # errors by session/task key, as recorded in the manifest
+    acquisition_metadata.attrs["errors"] = errors
+    return acquisition_metadata
+
+
+def _write_acquisition_metadata(acquisition_metadata: pd.DataFrame) -> Dict[str, Any]:
+    # values and data types are stored as is, such that the metadata of
+    # up-to-date sessions equals the metadata of the first run (e.g. missing
+    # values remain None instead of NaN)
+    return {
+        **acquisition_metadata.to_dict(orient="split"),
+        "dtypes": {
+            column: str(dtype) for column, dtype in acquisition_metadata.dtypes.items()
+        },
+    }
+
+
+def _read_acquisition_metadata(result: Union[str, Dict[str, Any]]) -> pd.DataFrame:
+    if isinstance(result, str):
+        # CSV metadata recorded by earlier versions
+        return pd.read_csv(StringIO(result), index_col=0)
+    acquisition_metadata = pd.DataFrame(
+        data=result["data"], index=result["index"], columns=result["columns"]
+    )
+    return acquisition_metadata.astype(result["dtypes"])
+
+
+def scan_sessions(
+    raw_dirs: Sequence[Union[str, PathLike]],
+    file_regex: str = "*.zip",
+    workers: Optional[int] = None,
+    temp_dir: Optional[Union[str, PathLike]] = None,
+    dtype: Optional[str] = None,
+    inventory_file: Optional[Union[str, PathLike]] = None,
+) -> pd.DataFrame:
+    if inventory_file is not None:
+        with Inventory(inventory_file) as inventory:
+            inventory.update(*raw_dirs)
+            sessions = _find_sessions(raw_dirs, file_regex, inventory=inventory)
+    else:
+        sessions = _find_sessions(raw_dirs, file_regex)
+    if workers is not None and workers > 1 and len(sessions) > 1:
+        with _worker_sinks() as worker_sinks, ProcessPoolExecutor(
+            max_workers=min(workers, len(sessions)),
+            initializer=_set_sinks,
+            initargs=(worker_sinks,),
+        ) as executor:
+            acquisition_metadatas = list(
+                executor.map(
+                    _scan_session,
+                    sessions,
+                    [temp_dir] * len(sessions),
+                    [dtype] * len(sessions),
+                )
+            )
+    else:
+        acquisition_metadatas = [
+            _scan_session(session, temp_dir, dtype) for session in sessions
+        ]
+    acquisition_metadatas = [
+        acquisition_metadata
+        for acquisition_metadata in acquisition_metadatas
+        if len(acquisition_metadata.index) > 0
+    ]
+    if len(acquisition_metadatas) == 0:
+        return pd.DataFrame()
+    return pd.concat(acquisition_metadatas, copy=False)
+
+
+def _scan_session(
+    session: _Session,
+    temp_dir: Optional[Union[str, PathLike]],
+    dtype: Optional[str],
+) -> pd.DataFrame:
+    # unreadable sessions are reported, instead of failing the whole scan
+    try:
+        if session.zip_file is not None:
+            return scan_zip_mcd_files(session.zip_file, temp_dir=temp_dir, dtype=dtype)
+        return pd.concat(
+            [
+                scan_mcd_file(mcd_file, txt_files=session.txt_files, dtype=dtype)
+                for mcd_file in session.mcd_files
+            ],
+            copy=False,
+        )
+    except Exception as e:
+        session_file = session.zip_file or session.mcd_files[0]
+        logging.error(f"Error scanning session {session_file.name}: {e}")
+        return pd.DataFrame()
+
+
+def _find_sessions(
+    raw_dirs: Sequence[Union[str, PathLike]],
+    file_regex: str,
+    inventory: Optional[Inventory] = None,
+) -> List[_Session]:
+    if inventory is not None:
+        return _find_inventory_sessions(raw_dirs, file_regex, inventory)
+    sessions: List[_Session] = []
+    for raw_dir in raw_dirs:
+        zip_files = [f for f in Path(raw_dir).rglob(file_regex) if f.suffix == ".zip"]
+        for zip_file in sorted(zip_files):
+            if not zip_file.stem.startswith("."):
+                sessions.append(_Session(zip_file, [], []))
+    for raw_dir in raw_dirs:
+        mcd_files = sorted(
+            f for f in Path(raw_dir).rglob("*.mcd") if not f.stem.startswith(".")
+        )
+        if len(mcd_files) > 0:
+            txt_files = [
+                f for f in Path(raw_dir).rglob("*.txt") if not f.stem.startswith(".")
+            ]
+            matched_txt_files = match_txt_files(mcd_files, txt_files)
+            for mcd_file in mcd_files:
+                sessions.append(_Session(None, [mcd_file], matched_txt_files[mcd_file]))
+    return sessions
+
+
+def _find_inventory_sessions(
+    raw_dirs: Sequence[Union[str, PathLike]], file_regex: str, inventory: Inventory
+) -> List[_Session]:
+    # same sessions as _find_sessions, looked up in the inventory instead of
+    # crawling the raw directories; .txt files have been matched when updating
+    sessions: List[_Session] = []
+    for raw_dir in raw_dirs:
+        for zip_file in inventory.get_files(raw_dir, role="zip"):
+            if zip_file.match(file_regex):
+                sessions.append(_Session(zip_file, [], []))
+    for raw_dir in raw_dirs:
+        mcd_files = inventory.get_files(raw_dir, role="mcd")
+        if len(mcd_files) > 0:
+            matched_mcd_file_stems = set()
+            for mcd_file in mcd_files:
+                txt_files = []
+                # .mcd files with the same name share their .txt files with the
+                # first one, as done by match_txt_files
+                if mcd_file.stem not in matched_mcd_file_stems:
+                    txt_files = inventory.get_files(
+                        raw_dir, role="txt", session=mcd_file.stem
+                    )
+                    matched_mcd_file_stems.add(mcd_file.stem)
+                sessions.append(_Session(None, [mcd_file], txt_files))
+            txt_file_table = inventory.get_file_table(raw_dir, role="txt")
+            unmatched_txt_file_names = [
+                Path(f).name
+                for f in txt_file_table.loc[txt_file_table["session"].isna(), "path"]
+            ]
+            if len(unmatched_txt_file_names) > 0:
+                logging.warning(
+                    "The following .txt files could not be matched to an .mcd file"
+                    f" and will be ignored: {unmatched_txt_file_names}"
+                )
+    return sessions
+
+
+def _check_session_channels(
+    sessions: Sequence[_Session], analysis_stacks: Sequence[AnalysisStack]
+) -> None:
+    # the panels of .mcd files are checked from their schemas before processing
+    # any sessions; .mcd files in .zip archives are checked once extracted
+    acquisition_channel_names: Dict[str, Sequence[str]] = {}
+    for session in sessions:
+        for mcd_file in session.mcd_files:
+            try:
+                with MCDFile(mcd_file) as f_mcd:
+                    acquisition_channel_names.update(_get_mcd_file_channel_names(f_mcd))
+            except Exception:
+                # unreadable files are reported when extracting the session
+                continue
+    _check_analysis_channels(acquisition_channel_names, analysis_stacks)
+
+
+def _get_acquisition_dir_tasks(
+    acquisition_dir: Path,
+    histocat_dir: Optional[Path],
+    analysis_stacks: Sequence[AnalysisStack],
+    hpf: Optional[float],
+    compression: Optional[str] = None,
+    predictor: bool = False,
+    inventory: Optional[Inventory] = None,
+) -> List[_Task]:
+    acquisition_img_files = _get_acquisition_img_files(
+        acquisition_dir, inventory=inventory
+    )
+    input_files = _get_acquisition_dir_input_files(acquisition_img_files)
+    tasks = []
+    if histocat_dir is not None:
+        tasks.append(
+            _Task(
+                f"export_to_histocat:{acquisition_dir.absolute()}",
+                export_to_histocat,
+                (acquisition_dir, histocat_dir),
+                {"compression": compression, "predictor": predictor},
+                input_files,
+                [histocat_dir / f.name[:-9] for f in acquisition_img_files],
+                {
+                    "histocat_dir": str(histocat_dir.absolute()),
+                    "compression": compression,
+                    "predictor": predictor,
+                },
+            )
+        )
+    if len(analysis_stacks) > 0:
+        tasks.append(
+            _Task(
+                f"create_analysis_stacks:{acquisition_dir.absolute()}",
+                create_multiple_analysis_stacks,
+                (acquisition_dir, analysis_stacks),
+                {"hpf": hpf, "compression": compression, "predictor": predictor},
+                input_files,
+                [
+                    Path(analysis_stack.analysis_dir)
+                    / (f.name[:-9] + (analysis_stack.suffix or "") + ext)
+                    for analysis_stack in analysis_stacks
+                    for f in acquisition_img_files
+                    for ext in (".tiff", ".csv")
+                ]
+                + [
+                    Path(analysis_stack.analysis_dir)
+                    / (
+                        f.name[:-9]
+                        + (analysis_stack.suffix or "")
+                        + f"_s{analysis_stack.ilastik_preparation.scale}"
+                        + f".{analysis_stack.ilastik_preparation.file_format}"
+                    )
+                    for analysis_stack in analysis_stacks
+                    if analysis_stack.ilastik_preparation is not None
+                    for f in acquisition_img_files
+                ],
+                {
+                    "analysis_stacks": [
+                        {
+                            "analysis_dir": str(
+                                Path(analysis_stack.analysis_dir).absolute()
+                            ),
+                            "analysis_channels": list(analysis_stack.analysis_channels),
+                            "suffix": analysis_stack.suffix,
+                            "ilastik_preparation": (
+                                _get_ilastik_preparation_params(
+                                    analysis_stack.ilastik_preparation
+                                )
+                                if analysis_stack.ilastik_preparation is not None
+                                else None
+                            ),
+                        }
+                        for analysis_stack in analysis_stacks
+                    ],
+                    "hpf": hpf,
+                    "compression": compression,
+                    "predictor": predictor,
+                },
+            )
+        )
+    return tasks
+
+
+def _get_ilastik_preparation_params(
+    ilastik_preparation: IlastikPreparation,
+) -> Dict[str, Any]:
+    return {
+        "crops_dir": str(Path(ilastik_preparation.crops_dir).absolute()),
+        "scale": ilastik_preparation.scale,
+        "crop_size": ilastik_preparation.crop_size,
+        "seed": ilastik_preparation.seed,
+        "file_format": ilastik_preparation.file_format,
+    }
+
+
+def _get_acquisition_img_files(
+    acquisition_dir: Path, inventory: Optional[Inventory] = None
+) -> List[Path]:
+    if inventory is not None:
+        return inventory.get_files(acquisition_dir, role="ometiff", recursive=False)
+    return sorted(acquisition_dir.glob("[!.]*.ome.tiff"))
+
+
+def _get_acquisition_dir_input_files(acquisition_img_files: List[Path]) -> List[Path]:
+    return acquisition_img_files + [
+        f.with_name(f.name[:-9] + ".csv") for f in acquisition_img_files
+    ]
+
+
+def _extract_session(
+    session: _Session,
+    acquisitions_dir: Path,
+    temp_dir: Optional[Union[str, PathLike]] = None,
+    analysis_stacks: Optional[Sequence[AnalysisStack]] = None,
+    hpf: Optional[float] = None,
+    histocat_dir: Optional[Path] = None,
+    tile_size: Optional[int] = None,
+    compression: Optional[str] = None,
+    predictor: bool = False,
+    dtype: Optional[str] = None,
+    embed_schema: bool = True,
+    overview_images: Optional[str] = "png",
+    thumbnail_size: int = 1024,
+    defer_overview_images: bool = False,
+    txt_cache_dir: Optional[Union[str, PathLike]] = None,
+    txt_workers: Optional[int] = None,
+    pipeline_depth: Optional[int] = None,
+) -> Tuple[
+    pd.DataFrame,
+    List[Path],
+    Dict[str, Dict[str, Any]],
+    Dict[str, Dict[str, Dict[str, Any]]],
+]:
+    # inputs are fingerprinted before they are read, such that changes during
+    # the extraction invalidate the manifest entry
+    input_fingerprints = get_file_fingerprints(session.input_files)
+    if session.zip_file is not None:
+        # temporary copies of the .mcd/.txt files are removed before the session
+        # is marked as done
+        acquisition_metadata = extract_zip_mcd_files(
+            session.zip_file,
+            acquisitions_dir,
+            temp_dir=temp_dir,
+            analysis_stacks=analysis_stacks,
+            hpf=hpf,
+            histocat_dir=histocat_dir,
+            tile_size=tile_size,
+            compression=compression,
+            predictor=predictor,
+            dtype=dtype,
+            embed_schema=embed_schema,
+            overview_images=overview_images,
+            thumbnail_size=thumbnail_size,
+            defer_overview_images=defer_overview_images,
+            txt_cache_dir=txt_cache_dir,
+            txt_workers=txt_workers,
+            pipeline_depth=pipeline_depth,
+        )
+    else:
+        acquisition_metadata = pd.concat(
+            [
+                extract_mcd_file(
+                    mcd_file,
+                    acquisitions_dir / mcd_file.stem,
+                    txt_files=session.txt_files,
+                    analysis_stacks=analysis_stacks,
+                    hpf=hpf,
+                    histocat_dir=histocat_dir,
+                    tile_size=tile_size,
+                    compression=compression,
+                    predictor=predictor,
+                    dtype=dtype,
+                    embed_schema=embed_schema,
+                    overview_images=overview_images,
+                    thumbnail_size=thumbnail_size,
+                    defer_overview_images=defer_overview_images,
+                    txt_cache_dir=txt_cache_dir,
+                    txt_workers=txt_workers,
+                    pipeline_depth=pipeline_depth,
+                )
+                for mcd_file in session.mcd_files
+            ],
+            copy=False,
+        )
+    acquisition_dirs = []
+    if len(acquisition_metadata.index) > 0:
+        acquisition_dirs = [
+            acquisitions_dir / acquisition_session
+            for acquisition_session in acquisition_metadata["AcSession"].unique()
+        ]
+    acquisition_dir_fingerprints = {}
+    if analysis_stacks is not None or histocat_dir is not None:
+        acquisition_dir_fingerprints = {
+            str(acquisition_dir): get_file_fingerprints(
+                _get_acquisition_dir_input_files(
+                    _get_acquisition_img_files(acquisition_dir)
+                )
+            )
+            for acquisition_dir in acquisition_dirs
+        }
+    return (
+        acquisition_metadata,
+        acquisition_dirs,
+        input_fingerprints,
+        acquisition_dir_fingerprints,
+    )
+
+
+def _run_task(
+    fun: Callable,
+    args: Tuple,
+    kwargs: Dict[str, Any],
+    input_files: List[Path],
+) -> Dict[str, Dict[str, Any]]:
+    input_fingerprints = get_file_fingerprints(input_files)
+    fun(*args, **kwargs)
+    return input_fingerprints
@@ -0,0 +1,77 @@
+from os import PathLike
+from pathlib import Path
+from typing import List, Optional, Union
+
+import numpy as np
+import pandas as pd
+from readimc import TXTFile
+
+from ._instrumentation import _stage
+from ._manifest import atomic_file, get_file_fingerprint
+
+TXT_CHUNK_SIZE = 65536
+
+
+def read_txt_acquisition(
+    txt_file: Union[str, PathLike],
+    txt_cache_dir: Optional[Union[str, PathLike]] = None,
+    chunk_size: int = TXT_CHUNK_SIZE,
+    txt_file_sha256: Optional[str] = None,
+) -> np.ndarray:
+    # decoded acquisitions are cached by the checksum of the .txt file, such
+    # that reruns memory-map the cached array instead of parsing the file again;
+    # callers that already know the checksum can pass it to skip hashing
+    txt_cache_file = None
+    if txt_cache_dir is not None:
+        if txt_file_sha256 is None:
+            txt_file_sha256 = _get_txt_file_sha256(txt_file)
+        txt_cache_file = Path(txt_cache_dir) / f"{txt_file_sha256}.npy"
+        if txt_cache_file.exists():
+            return np.load(txt_cache_file, mmap_mode="r")
+    with _stage("txt_decode", file=Path(txt_file).name) as event:
+        with TXTFile(txt_file) as f_txt:
+            img = _read_txt_acquisition(f_txt, chunk_size)
+        event["bytes_read"] = Path(txt_file).stat().st_size
+        if txt_cache_file is not None:
+            Path(txt_cache_file).parent.mkdir(parents=True, exist_ok=True)
+            with atomic_file(txt_cache_file) as temp_txt_cache_file:
+                with temp_txt_cache_file.open("wb") as f:
+                    np.save(f, img)
+            event["bytes_written"] = img.nbytes
+    return img
+
+
+def _get_txt_file_sha256(txt_file: Union[str, PathLike]) -> str:
+    return get_file_fingerprint(txt_file, checksum=True)["sha256"]
+
+
+def _read_txt_acquisition(txt_file_handle: TXTFile, chunk_size: int) -> np.ndarray:
+    # same result as TXTFile.read_acquisition, but only the X, Y and channel
+    # columns are parsed, chunk by chunk, into a channels-first image
+    num_channels = txt_file_handle.num_channels
+    xs: List[np.ndarray] = []
+    ys: List[np.ndarray] = []
+    chunk_imgs: List[np.ndarray] = []
+    with pd.read_table(
+        txt_file_handle.path,
+        dtype=np.float32,
+        usecols=[3, 4] + list(range(6, 6 + num_channels)),
+        chunksize=chunk_size,
+    ) as reader:
+        for chunk in reader:
+            chunk_values = chunk.to_numpy(dtype=np.float32)
+            xs.append(chunk_values[:, 0].astype(int))
+            ys.append(chunk_values[:, 1].astype(int))
+            chunk_imgs.append(np.ascontiguousarray(chunk_values[:, 2:].T))
+    num_pixels = sum(len(x) for x in xs)
+    width = max((int(x.max()) + 1 for x in xs if len(x) > 0), default=0)
+    height = max((int(y.max()) + 1 for y in ys if len(y) > 0), default=0)
+    if width * height != num_pixels:
+        raise IOError(
+            f"TXT file '{txt_file_handle.path.name}' corrupted: "
+            "inconsistent acquisition image data size"
+        )
+    img = np.zeros((num_channels, height, width), dtype=np.float32)
+    for chunk_y, chunk_x, chunk_img in zip(ys, xs, chunk_imgs):
+        img[:, chunk_y, chunk_x] = chunk_img
+    return img
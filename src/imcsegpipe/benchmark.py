@@ -0,0 +1,377 @@
+import argparse
+import json
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import BytesIO
+from multiprocessing import get_context
+from os import PathLike
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import imageio
+import numpy as np
+
+from ._imcsegpipe import (
+    _open_acquisition_img,
+    create_analysis_stacks,
+    export_to_histocat,
+    extract_mcd_file,
+)
+from ._instrumentation import _get_peak_rss, _reset_peak_rss
+from .utils import filter_hot_pixels
+
+BENCHMARK_STAGES = [
+    "extract_mcd_file",
+    "filter_hot_pixels",
+    "create_analysis_stacks",
+    "export_to_histocat",
+    "read_acquisitions",
+]
+
+_CHANNEL_METALS = ["La", "Pr", "Nd", "Sm", "Eu", "Gd", "Tb", "Dy", "Ho", "Er", "Yb"]
+
+
+def get_synthetic_channel_names(num_channels: int) -> List[str]:
+    return [f"{metal}{mass}" for metal, mass in _get_synthetic_channels(num_channels)]
+
+
+def _get_synthetic_channels(num_channels: int) -> List[Tuple[str, int]]:
+    return [
+        (_CHANNEL_METALS[i % len(_CHANNEL_METALS)], 139 + i)
+        for i in range(num_channels)
+    ]
+
+
+def create_synthetic_image(
+    num_channels: int,
+    height: int,
+    width: int,
+    hot_pixel_fraction: float = 1e-4,
+    seed: int = 0,
+) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    img = rng.poisson(3.0, size=(num_channels, height, width)).astype(np.float32)
+    num_hot_pixels = int(hot_pixel_fraction * img.size)
+    hot_pixel_indices = rng.integers(img.size, size=num_hot_pixels)
+    img.flat[hot_pixel_indices] = rng.uniform(100.0, 1000.0, size=num_hot_pixels)
+    return img
+
+
+def write_synthetic_mcd_file(
+    mcd_file: Union[str, PathLike],
+    num_acquisitions: int,
+    num_channels: int,
+    height: int,
+    width: int,
+    seed: int = 0,
+) -> None:
+    data = bytearray(16)
+    # slide and panorama images start 161 bytes after their start offset
+    png_buffer = BytesIO()
+    imageio.imwrite(png_buffer, np.zeros((32, 32, 3), dtype=np.uint8), format="png")
+    image_offsets = []
+    for _ in range(2):
+        image_start_offset = len(data)
+        data += bytes(161) + png_buffer.getvalue()
+        image_offsets.append((image_start_offset, len(data)))
+    slide_start_offset, slide_end_offset = image_offsets[0]
+    panorama_start_offset, panorama_end_offset = image_offsets[1]
+    acquisition_elems = []
+    ys, xs = np.mgrid[:height, :width]
+    for acquisition_id in range(1, num_acquisitions + 1):
+        img = create_synthetic_image(
+            num_channels, height, width, seed=seed + acquisition_id
+        )
+        # pixel-interleaved X, Y, Z and channel values, as stored by the instrument
+        acquisition_data = np.empty((height * width, num_channels + 3), np.float32)
+        acquisition_data[:, 0] = xs.ravel()
+        acquisition_data[:, 1] = ys.ravel()
+        acquisition_data[:, 2] = 0
+        acquisition_data[:, 3:] = img.reshape((num_channels, -1)).T
+        data_start_offset = len(data)
+        data += acquisition_data.tobytes()
+        acquisition_elems.append(
+            "<Acquisition>"
+            f"<ID>{acquisition_id}</ID>"
+            f"<Description>ROI_{acquisition_id:03d}</Description>"
+            f"<AcquisitionROIID>{acquisition_id}</AcquisitionROIID>"
+            f"<OrderNumber>{acquisition_id}</OrderNumber>"
+            f"<DataStartOffset>{data_start_offset}</DataStartOffset>"
+            f"<DataEndOffset>{len(data)}</DataEndOffset>"
+            "<ValueBytes>4</ValueBytes>"
+            f"<MaxX>{width}</MaxX>"
+            f"<MaxY>{height}</MaxY>"
+            "</Acquisition>"
+            "<AcquisitionROI>"
+            f"<ID>{acquisition_id}</ID>"
+            "<PanoramaID>1</PanoramaID>"
+            "</AcquisitionROI>"
+        )
+        for order_number, (channel_name, channel_label) in enumerate(
+            [("X", "X"), ("Y", "Y"), ("Z", "Z")]
+            + [
+                (f"{metal}({mass})", f"Marker{i + 1}")
+                for i, (metal, mass) in enumerate(_get_synthetic_channels(num_channels))
+            ]
+        ):
+            acquisition_elems.append(
+                "<AcquisitionChannel>"
+                f"<ID>{acquisition_id * 1000 + order_number}</ID>"
+                f"<AcquisitionID>{acquisition_id}</AcquisitionID>"
+                f"<OrderNumber>{order_number}</OrderNumber>"
+                f"<ChannelName>{channel_name}</ChannelName>"
+                f"<ChannelLabel>{channel_label}</ChannelLabel>"
+                "</AcquisitionChannel>"
+            )
+    schema_xml = (
+        '<MCDSchema xmlns="http://www.fluidigm.com/IMC/MCDSchema_V2_0.xsd">'
+        "<Slide>"
+        "<ID>0</ID>"
+        f"<ImageStartOffset>{slide_start_offset}</ImageStartOffset>"
+        f"<ImageEndOffset>{slide_end_offset}</ImageEndOffset>"
+        "</Slide>"
+        "<Panorama>"
+        "<ID>1</ID>"
+        "<SlideID>0</SlideID>"
+        "<Type>Imported</Type>"
+        f"<ImageStartOffset>{panorama_start_offset}</ImageStartOffset>"
+        f"<ImageEndOffset>{panorama_end_offset}</ImageEndOffset>"
+        "</Panorama>" + "".join(acquisition_elems) + "</MCDSchema>"
+    )
+    data += schema_xml.encode("utf-16-le")
+    Path(mcd_file).write_bytes(data)
+
+
+def run_benchmarks(
+    roi_sizes: Sequence[Tuple[int, int]] = ((1000, 1000),),
+    channel_counts: Sequence[int] = (40,),
+    num_acquisitions: int = 2,
+    stages: Optional[Sequence[str]] = None,
+    workers: Optional[int] = None,
+    repeats: int = 1,
+    temp_dir: Optional[Union[str, PathLike]] = None,
+    compression: Optional[str] = None,
+    predictor: bool = False,
+    dtype: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    if stages is None:
+        stages = BENCHMARK_STAGES
+    unknown_stages = set(stages).difference(BENCHMARK_STAGES)
+    if len(unknown_stages) > 0:
+        raise ValueError(f"Unknown benchmark stages: {sorted(unknown_stages)}")
+    results = []
+    for height, width in roi_sizes:
+        for num_channels in channel_counts:
+            with TemporaryDirectory(dir=temp_dir) as benchmark_dir:
+                mcd_file = Path(benchmark_dir) / "benchmark.mcd"
+                write_synthetic_mcd_file(
+                    mcd_file, num_acquisitions, num_channels, height, width
+                )
+                for repeat in range(repeats):
+                    for stage in stages:
+                        result = _run_benchmark_stage(
+                            stage,
+                            mcd_file,
+                            num_acquisitions,
+                            num_channels,
+                            height,
+                            width,
+                            workers=workers,
+                            compression=compression,
+                            predictor=predictor,
+                            dtype=dtype,
+                        )
+                        result["repeat"] = repeat
+                        results.append(result)
+    return results
+
+
+def _run_benchmark_stage(
+    stage: str,
+    mcd_file: Path,
+    num_acquisitions: int,
+    num_channels: int,
+    height: int,
+    width: int,
+    workers: Optional[int] = None,
+    compression: Optional[str] = None,
+    predictor: bool = False,
+    dtype: Optional[str] = None,
+) -> Dict[str, Any]:
+    # every stage runs in a fresh process, such that the peak memory usage of
+    # one stage does not affect the measurements of the following stages
+    with ProcessPoolExecutor(
+        max_workers=1, mp_context=get_context("spawn")
+    ) as executor:
+        result = executor.submit(
+            _benchmark_stage_job,
+            stage,
+            mcd_file,
+            num_channels,
+            height,
+            width,
+            workers=workers,
+            compression=compression,
+            predictor=predictor,
+            dtype=dtype,
+        ).result()
+    return {
+        "stage": stage,
+        "num_acquisitions": num_acquisitions,
+        "num_channels": num_channels,
+        "height": height,
+        "width": width,
+        "workers": workers,
+        "compression": compression,
+        "predictor": predictor,
+        "dtype": dtype,
+        **result,
+    }
+
+
+def _benchmark_stage_job(
+    stage: str,
+    mcd_file: Path,
+    num_channels: int,
+    height: int,
+    width: int,
+    workers: Optional[int] = None,
+    compression: Optional[str] = None,
+    predictor: bool = False,
+    dtype: Optional[str] = None,
+) -> Dict[str, Any]:
+    write_kwargs: Dict[str, Any] = {"compression": compression, "predictor": predictor}
+    acquisition_dir = mcd_file.parent / "ometiff"
+    stage_fun: Callable[[], Any]
+    img: Optional[np.ndarray] = None
+    input_files: List[Path] = []
+    output_dir: Optional[Path] = None
+    if stage == "extract_mcd_file":
+        input_files = [mcd_file]
+        output_dir = mcd_file.parent / "ometiff_benchmark"
+        stage_fun = partial(
+            extract_mcd_file,
+            mcd_file,
+            output_dir,
+            workers=workers,
+            dtype=dtype,
+            **write_kwargs,
+        )
+    elif stage == "filter_hot_pixels":
+        img = create_synthetic_image(num_channels, height, width)
+        stage_fun = partial(filter_hot_pixels, img, 50.0, workers=workers)
+    else:
+        # the acquisition images are extracted only once, outside of the timing
+        if not acquisition_dir.exists():
+            extract_mcd_file(mcd_file, acquisition_dir, dtype=dtype, **write_kwargs)
+        input_files = sorted(acquisition_dir.glob("[!.]*.ome.tiff"))
+        output_dir = mcd_file.parent / stage
+        if stage == "create_analysis_stacks":
+            channel_names = get_synthetic_channel_names(num_channels)
+            stage_fun = partial(
+                create_analysis_stacks,
+                acquisition_dir,
+                output_dir,
+                channel_names,
+                suffix="_full",
+                hpf=50.0,
+                **write_kwargs,
+            )
+        elif stage == "export_to_histocat":
+            stage_fun = partial(
+                export_to_histocat,
+                acquisition_dir,
+                output_dir,
+                workers=workers,
+                **write_kwargs,
+            )
+        else:
+            output_dir = None
+            stage_fun = partial(_read_acquisitions, input_files)
+    _reset_peak_rss()
+    start_rss = _get_peak_rss()
+    start_time = time.perf_counter()
+    stage_fun()
+    time_s = time.perf_counter() - start_time
+    result: Dict[str, Any] = {
+        "time_s": time_s,
+        "start_rss_bytes": start_rss,
+        "peak_rss_bytes": _get_peak_rss(),
+    }
+    if img is not None:
+        result["input_bytes"] = result["output_bytes"] = img.nbytes
+    else:
+        result["input_bytes"] = sum(f.stat().st_size for f in input_files)
+        result["output_bytes"] = 0
+        if output_dir is not None:
+            result["output_bytes"] = sum(
+                f.stat().st_size for f in output_dir.rglob("*") if f.is_file()
+            )
+    return result
+
+
+def _read_acquisitions(acquisition_img_files: Sequence[Path]) -> None:
+    # channels are read one at a time, as done when creating analysis stacks
+    # and exporting to histoCAT
+    for acquisition_img_file in acquisition_img_files:
+        with _open_acquisition_img(acquisition_img_file) as acquisition_img:
+            for channel_index in range(acquisition_img.shape[0]):
+                np.asarray(acquisition_img[channel_index]).sum()
+
+
+def _parse_roi_size(roi_size: str) -> Tuple[int, int]:
+    height, width = roi_size.lower().split("x")
+    return int(height), int(width)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m imcsegpipe.benchmark",
+        description="Benchmark the pre-processing steps on synthetic data",
+    )
+    parser.add_argument(
+        "--roi-sizes", nargs="+", type=_parse_roi_size, default=[(1000, 1000)]
+    )
+    parser.add_argument("--channels", nargs="+", type=int, default=[40])
+    parser.add_argument("--acquisitions", type=int, default=2)
+    parser.add_argument(
+        "--stages", nargs="+", choices=BENCHMARK_STAGES, default=BENCHMARK_STAGES
+    )
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--temp-dir")
+    parser.add_argument("--compression")
+    parser.add_argument("--predictor", action="store_true")
+    parser.add_argument("--dtype")
+    parser.add_argument("-o", "--output")
+    args = parser.parse_args(argv)
+    results = run_benchmarks(
+        roi_sizes=args.roi_sizes,
+        channel_counts=args.channels,
+        num_acquisitions=args.acquisitions,
+        stages=args.stages,
+        workers=args.workers,
+        repeats=args.repeats,
+        temp_dir=args.temp_dir,
+        compression=args.compression,
+        predictor=args.predictor,
+        dtype=args.dtype,
+    )
+    benchmark = {
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(benchmark, f, indent=2)
+    else:
+        json.dump(benchmark, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,14 @@
 import re
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import List, Optional, Sequence
+from os import PathLike
+from typing import List, Optional, Sequence, Tuple, Union
 from xml.etree import ElementTree as ET
 
 import numpy as np
 import xtiff
 from readimc import MCDFile
 from readimc.data import Acquisition
-from scipy.ndimage import maximum_filter
 
 
 @dataclass
@@ -111,6 +112,23 @@ class AcquisitionMetadata:
         )
 
 
+@dataclass
+class IlastikPreparation:
+    crops_dir: Union[str, PathLike]
+    scale: int = 2
+    crop_size: Optional[int] = 500
+    seed: int = 0
+    file_format: str = "h5"
+
+
+@dataclass
+class AnalysisStack:
+    analysis_dir: Union[str, PathLike]
+    analysis_channels: Sequence[str]
+    suffix: Optional[str] = None
+    ilastik_preparation: Optional[IlastikPreparation] = None
+
+
 def get_acquisition_ome_xml(
     img: np.ndarray,
     image_name: Optional[str],
@@ -120,6 +138,7 @@ def get_acquisition_ome_xml(
     pixel_depth: Optional[float],
     channel_fluors: Optional[Sequence[str]] = None,
     xml_metadata: Optional[str] = None,
+    xml_metadata_key: str = "MCD-XML",
     **ome_xml_kwargs,
 ) -> ET.ElementTree:
     element_tree = xtiff.get_ome_xml(
@@ -140,23 +159,64 @@ def get_acquisition_ome_xml(
         for channel_elem, channel_fluor in zip(channel_elems, channel_fluors):
             channel_elem.set("Fluor", channel_fluor)
     if xml_metadata is not None:
-        structured_annot_elem = ET.SubElement(root_elem, "StructuredAnnotations")
-        xml_annot_elem = ET.SubElement(structured_annot_elem, "XMLAnnotation")
-        xml_annot_elem.set("ID", "Annotation:0")
-        xml_annot_value_elem = ET.SubElement(xml_annot_elem, "Value")
-        orig_metadata_elem = ET.SubElement(xml_annot_value_elem, "OriginalMetadata")
-        orig_metadata_key_elem = ET.SubElement(orig_metadata_elem, "Key")
-        orig_metadata_key_elem.text = "MCD-XML"
-        orig_metadata_value_elem = ET.SubElement(orig_metadata_elem, "Value")
-        orig_metadata_value_elem.text = xml_metadata
+        root_elem.append(_get_xml_annotation_elem(xml_metadata, xml_metadata_key))
     return element_tree
 
 
-def filter_hot_pixels(img: np.ndarray, thres: float) -> np.ndarray:
-    kernel = np.ones((1, 3, 3), dtype=bool)
-    kernel[0, 1, 1] = False
-    max_neighbor_img = maximum_filter(img, footprint=kernel, mode="mirror")
-    return np.where(img - max_neighbor_img > thres, max_neighbor_img, img)
+def _get_xml_annotation_elem(xml_metadata: str, xml_metadata_key: str) -> ET.Element:
+    structured_annot_elem = ET.Element("StructuredAnnotations")
+    xml_annot_elem = ET.SubElement(structured_annot_elem, "XMLAnnotation")
+    xml_annot_elem.set("ID", "Annotation:0")
+    xml_annot_value_elem = ET.SubElement(xml_annot_elem, "Value")
+    orig_metadata_elem = ET.SubElement(xml_annot_value_elem, "OriginalMetadata")
+    orig_metadata_key_elem = ET.SubElement(orig_metadata_elem, "Key")
+    orig_metadata_key_elem.text = xml_metadata_key
+    orig_metadata_value_elem = ET.SubElement(orig_metadata_elem, "Value")
+    orig_metadata_value_elem.text = xml_metadata
+    return structured_annot_elem
+
+
+def filter_hot_pixels(
+    img: np.ndarray,
+    thres: float,
+    in_place: bool = False,
+    workers: Optional[int] = None,
+) -> np.ndarray:
+    if not in_place:
+        img = img.copy()
+
+    # channels are filtered one by one in the native data type, such that only
+    # few temporary channel-sized arrays are allocated at a time
+    def filter_channel(channel_index: Tuple[int, ...]) -> None:
+        channel_img = img[channel_index]
+        max_neighbor_img = _get_max_neighbor_img(channel_img)
+        hot_pixel_mask = channel_img - max_neighbor_img > thres
+        if np.issubdtype(img.dtype, np.integer):
+            # differences of unsigned integers wrap around
+            hot_pixel_mask &= channel_img > max_neighbor_img
+        channel_img[hot_pixel_mask] = max_neighbor_img[hot_pixel_mask]
+
+    channel_indices = list(np.ndindex(img.shape[:-2]))
+    if workers is not None and workers > 1 and len(channel_indices) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(filter_channel, channel_indices))
+    else:
+        for channel_index in channel_indices:
+            filter_channel(channel_index)
+    return img
+
+
+def _get_max_neighbor_img(channel_img: np.ndarray) -> np.ndarray:
+    # maximum of the 3x3 neighborhood excluding the center pixel, equivalent to
+    # scipy.ndimage.maximum_filter with mode="mirror": the maximum of the rows
+    # above and below (3 pixels each) and of the left and right neighbors
+    padded_img = np.pad(channel_img, 1, mode="reflect")
+    row_max_img = np.maximum(padded_img[:, :-2], padded_img[:, 1:-1])
+    np.maximum(row_max_img, padded_img[:, 2:], out=row_max_img)
+    max_neighbor_img = np.maximum(row_max_img[:-2], row_max_img[2:])
+    np.maximum(max_neighbor_img, padded_img[1:-1, :-2], out=max_neighbor_img)
+    np.maximum(max_neighbor_img, padded_img[1:-1, 2:], out=max_neighbor_img)
+    return max_neighbor_img
 
 
 def sort_channels_by_mass(channels: Sequence[str]) -> List[str]: